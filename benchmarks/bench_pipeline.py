@@ -0,0 +1,209 @@
+"""
+Benchmark the stages of the exhibit pipeline on a synthetic gallery.
+
+Usage: python benchmarks/bench_pipeline.py [options]
+
+A gallery of the requested size is generated in a temporary directory, and
+built (in-process, with a single job, so that the stages can be timed):
+
+- cold: from scratch;
+- warm: again, without any change;
+- incremental: after modifying a single script;
+- cached: from scratch, but keeping the execution cache.
+
+The time spent in each stage (inclusive of the stages that it calls) is
+printed, and optionally saved as JSON, which can later be passed to
+--compare.
+"""
+
+import argparse
+import collections
+import contextlib
+import functools
+import inspect
+import json
+from pathlib import Path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import sphinx
+from sphinx.cmd.build import build_main
+
+import sphinx_exhibit
+from sphinx_exhibit import _implementation
+
+
+STAGES = [
+    "split_text_and_code_blocks",
+    "doc_info_from_py_source",
+    "execute_exhibit",
+    "resolve_docrefs",
+    "embed_annotations",
+    "generate_notebook",
+]
+SCENARIOS = ["cold", "warm", "incremental", "cached"]
+
+
+def write_gallery(path, *, n_scripts, n_cells, n_figures, n_loops):
+    (path / "source").mkdir(parents=True)
+    (path / "examples").mkdir()
+    (path / "source/conf.py").write_text(
+        "extensions = ['sphinx_exhibit']\n"
+        "master_doc = 'index'\n"
+        "exhibit_cache_dir = {!r}\n".format(str(path / "cache")))
+    (path / "source/index.rst").write_text(
+        "Gallery\n"
+        "=======\n"
+        "\n"
+        ".. exhibit::\n"
+        "   :srcdir: ../examples\n"
+        "   :destdir: examples\n"
+        "\n"
+        "   *.py\n")
+    for i in range(n_scripts):
+        parts = ['"""\nExample {}\n{}\n"""\n\n'
+                 "import numpy as np\n"
+                 "import matplotlib.pyplot as plt\n\n"
+                 .format(i, "=" * len("Example {}".format(i)))]
+        for j in range(n_cells):
+            parts.append(
+                '"""\nCell {j}, with *some* ``markup``.\n"""\n\n'
+                "total = 0\n"
+                "for k in range({n_loops}):\n"
+                "    total += np.sin(k) * k\n"
+                "for _ in range({n_figures}):\n"
+                "    fig, ax = plt.subplots()\n"
+                "    ax.plot(np.arange(10) * {j})\n"
+                "print(total)\n\n"
+                .format(j=j, n_loops=n_loops, n_figures=n_figures))
+        (path / "examples/example_{:04}.py".format(i)).write_text(
+            "".join(parts))
+
+
+@contextlib.contextmanager
+def timing_stages(timings):
+    def wrap(name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                # Generators only do their work when consumed.
+                return (list(func(*args, **kwargs))
+                        if inspect.isgeneratorfunction(func) else
+                        func(*args, **kwargs))
+            finally:
+                timings[name]["calls"] += 1
+                timings[name]["time"] += time.perf_counter() - start
+        return wrapper
+
+    funcs = {name: getattr(_implementation, name) for name in STAGES}
+    for name, func in funcs.items():
+        setattr(_implementation, name, wrap(name, func))
+    try:
+        yield
+    finally:
+        for name, func in funcs.items():
+            setattr(_implementation, name, func)
+
+
+def build(path):
+    timings = collections.defaultdict(lambda: {"calls": 0, "time": 0.})
+    start = time.perf_counter()
+    with timing_stages(timings):
+        status = build_main(
+            ["-q", "-b", "html", "-d", str(path / "build/doctrees"),
+             str(path / "source"), str(path / "build/html")])
+    total = time.perf_counter() - start
+    if status:
+        raise SystemExit("Build failed.")
+    return {"total": total, "stages": {name: timings[name] for name in STAGES}}
+
+
+def run_scenarios(path):
+    results = {}
+    results["cold"] = build(path)
+    results["warm"] = build(path)
+    script = sorted((path / "examples").glob("*.py"))[0]
+    with script.open("a") as file:
+        file.write("print('modified')\n")
+    results["incremental"] = build(path)
+    shutil.rmtree(str(path / "build"))
+    for generated in (path / "source/examples").glob("*"):
+        generated.unlink()
+    results["cached"] = build(path)
+    return results
+
+
+def print_results(results, reference=None):
+    print("{:<28}".format("") + "".join(
+        "{:>16}".format(scenario) for scenario in SCENARIOS))
+    for name in ["total", *STAGES]:
+        cells = []
+        for scenario in SCENARIOS:
+            result = results[scenario]
+            elapsed = (result["total"] if name == "total"
+                       else result["stages"][name]["time"])
+            cell = "{:.4f}".format(elapsed)
+            if reference:
+                ref_result = reference["results"][scenario]
+                ref_elapsed = (ref_result["total"] if name == "total"
+                               else ref_result["stages"][name]["time"])
+                if ref_elapsed:
+                    cell += " ({:.2f}x)".format(elapsed / ref_elapsed)
+            cells.append("{:>16}".format(cell))
+        print("{:<28}".format(name) + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scripts", type=int, default=20)
+    parser.add_argument("--cells", type=int, default=5)
+    parser.add_argument("--figures", type=int, default=1,
+                        help="Figures per cell.")
+    parser.add_argument("--loops", type=int, default=1000,
+                        help="Iterations of the loop in each cell.")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="Save the results as JSON to this path.")
+    parser.add_argument("--compare", type=Path,
+                        help="Compare with results previously saved as JSON.")
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep the generated gallery and build.")
+    args = parser.parse_args()
+
+    params = {"scripts": args.scripts, "cells": args.cells,
+              "figures": args.figures, "loops": args.loops}
+    path = Path(tempfile.mkdtemp(prefix="exhibit-bench-"))
+    try:
+        write_gallery(path, n_scripts=args.scripts, n_cells=args.cells,
+                      n_figures=args.figures, n_loops=args.loops)
+        results = run_scenarios(path)
+    finally:
+        if args.keep:
+            print("Gallery kept in {}.".format(path))
+        else:
+            shutil.rmtree(str(path))
+
+    reference = (json.loads(args.compare.read_text()) if args.compare
+                 else None)
+    if reference and reference["params"] != params:
+        print("Warning: comparing with results for {}.".format(
+            reference["params"]), file=sys.stderr)
+    print_results(results, reference)
+    if args.output:
+        args.output.write_text(json.dumps({
+            "params": params,
+            "python": sys.version,
+            "platform": platform.platform(),
+            "sphinx": sphinx.__version__,
+            "sphinx_exhibit": sphinx_exhibit.__version__,
+            "time": time.time(),
+            "results": results,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark the splitting of example scripts into text and code blocks.
+
+Usage: python benchmarks/bench_split.py [path ...]
+
+Each path is either a script or a directory (searched recursively for
+scripts); the default is the examples of the test suite.  If lib2to3 is
+available, the previous, lib2to3-based implementation is also timed, and its
+output checked to be identical (scripts that it fails to parse, e.g. because
+they pass keyword arguments to print(), are skipped).
+"""
+
+import argparse
+import ast
+import itertools
+from pathlib import Path
+import re
+import time
+
+from sphinx_exhibit._implementation import split_text_and_code_blocks
+
+
+def legacy_split_text_and_code_blocks(src):
+    from lib2to3 import pygram, pytree
+    from lib2to3.pgen2.driver import Driver
+
+    tree = Driver(pygram.python_grammar, pytree.convert).parse_string(
+        src + "\n", True)
+    if isinstance(tree, pytree.Leaf):
+        tree = pytree.Node(pygram.python_symbols.file_input, [tree])
+
+    def _inner():
+        for i, node in enumerate(tree.children):
+            if (node.type == pygram.python_symbols.simple_stmt
+                    and node.children[0].type == pygram.token.STRING
+                    and not re.search(
+                        r"""\A[^'"]*[bBfF]""", node.children[0].value)):
+                tree.children[i + 1].prefix = (
+                    node.prefix + tree.children[i + 1].prefix)
+                yield ("text",
+                       ast.literal_eval(
+                           "".join(leaf.value for leaf in node.leaves())),
+                       node.get_lineno())
+            else:
+                yield ("code", node, node.get_lineno())
+
+    for tp, it_group in itertools.groupby(_inner(), lambda kv: kv[0]):
+        _, strs_or_nodes, linenos = zip(*it_group)
+        if tp == "text":
+            string = "".join(strs_or_nodes)
+        else:
+            nodes = [*strs_or_nodes]
+            nodes[0].prefix = ""
+            string = "".join(map(str, nodes)).rstrip("\n") + "\n"
+        yield tp, string, linenos[0]
+
+
+def time_split(func, sources):
+    start = time.perf_counter()
+    results = [[*func(src)] for src in sources]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "paths", nargs="*", type=Path,
+        default=[Path(__file__).resolve().parents[1] / "tests/sphinx-tree"])
+    args = parser.parse_args()
+
+    sources = [
+        path.read_text(encoding="utf-8")
+        for path in itertools.chain.from_iterable(
+            sorted(path.glob("**/*.py")) if path.is_dir() else [path]
+            for path in args.paths)]
+    print("{} scripts, {} lines".format(
+        len(sources), sum(src.count("\n") for src in sources)))
+    elapsed, results = time_split(split_text_and_code_blocks, sources)
+    print("tokenize: {:.3f}s".format(elapsed))
+    try:
+        from lib2to3.pgen2.parse import ParseError
+    except ImportError:
+        return
+    parseable = []
+    for src, result in zip(sources, results):
+        try:
+            [*legacy_split_text_and_code_blocks(src)]
+        except ParseError:
+            pass
+        else:
+            parseable.append((src, result))
+    print("{} scripts parseable by lib2to3".format(len(parseable)))
+    sources, results = map(list, zip(*parseable))
+    elapsed, _ = time_split(split_text_and_code_blocks, sources)
+    print("tokenize: {:.3f}s".format(elapsed))
+    legacy_elapsed, legacy_results = time_split(
+        legacy_split_text_and_code_blocks, sources)
+    print("lib2to3:  {:.3f}s".format(legacy_elapsed))
+    if results != legacy_results:
+        raise SystemExit("Outputs differ.")
+
+
+if __name__ == "__main__":
+    main()
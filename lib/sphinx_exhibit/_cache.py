@@ -0,0 +1,145 @@
+"""
+Persistent, content-addressed caches of execution results and of the
+instrumented code of the examples.
+
+Execution results are keyed on everything that is known before running an
+example (its source, the files it declares, the Matplotlib configuration,
+...); the project modules that it imports are only known after running it, so
+they are stored in the entry and checked when loading it.
+"""
+
+import hashlib
+import importlib.util
+import marshal
+from pathlib import Path
+import pickle
+import sys
+
+import matplotlib as mpl
+
+from . import __version__, _util
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    try:
+        return hash_bytes(Path(path).read_bytes())
+    except FileNotFoundError:
+        return None
+
+
+def is_project_file(path, project_root):
+    try:
+        rel_path = Path(path).resolve().relative_to(project_root)
+    except ValueError:
+        return False
+    # Also excludes virtualenvs living in the project tree.
+    return "site-packages" not in rel_path.parts
+
+
+class ExecutionCache:
+    def __init__(self, path, project_root, settings=()):
+        self._path = Path(path)
+        self._project_root = Path(project_root).resolve()
+        # Other settings affecting the results.
+        self._settings = [*settings]
+
+    def get_key(self, docname, doc_info):
+        src_dir = doc_info.src_path.parent
+        parts = [
+            __version__,
+            sys.version,
+            *self._settings,
+            mpl.__version__,
+            repr(sorted(mpl.rcParams.items())),
+            docname,
+            hash_file(doc_info.src_path),
+            repr(doc_info.code_line_ranges),
+            repr(doc_info.capture_after_lines),
+            doc_info.output_style.value,
+            repr(doc_info.image_settings),
+            *["{}:{}".format(path, hash_file(src_dir / path))
+              for path in doc_info.declared_files],
+        ]
+        return hash_bytes("\0".join(map(str, parts)).encode("utf-8"))
+
+    def load(self, key, srcdir):
+        """
+        Return the cached `DocInfo` for *key*, or None.
+
+        The saved files (artefacts, etc.) are restored into *srcdir* as a side
+        effect.
+        """
+        try:
+            with (self._path / (key + ".pickle")).open("rb") as file:
+                entry = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if any(hash_file(self._project_root / path) != digest
+               for path, digest in entry["dependencies"].items()):
+            return None
+        for path, data in entry["files"].items():
+            dest = Path(srcdir, path)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if hash_file(dest) != hash_bytes(data):
+                dest.write_bytes(data)
+        return entry["doc_info"]
+
+    def store(self, key, srcdir, doc_info):
+        entry = {
+            "dependencies": {
+                Path(path).resolve().relative_to(self._project_root)
+                .as_posix(): hash_file(path)
+                for path in doc_info.imported_files},
+            "files": {path: Path(srcdir, path).read_bytes()
+                      for path in doc_info.iter_saved_files()},
+            "doc_info": doc_info,
+        }
+        self._path.mkdir(parents=True, exist_ok=True)
+        path = self._path / (key + ".pickle")
+        with _util.atomic_write_cm(path) as tmp_path, \
+             tmp_path.open("wb") as file:
+            pickle.dump(entry, file)
+
+
+class CodeCache:
+    """
+    A persistent cache of the compiled, instrumented code of the examples.
+
+    The instrumentation embeds the annotation offsets in the code object, so
+    this skips parsing, rewriting and compiling the examples altogether.
+    """
+
+    def __init__(self, path):
+        self._path = Path(path)
+
+    def get_key(self, doc_info, settings=()):
+        parts = [
+            __version__,
+            sys.version,
+            importlib.util.MAGIC_NUMBER.hex(),
+            *settings,
+            doc_info.src_path,  # Embedded in the code object.
+            hash_file(doc_info.src_path),
+            repr(doc_info.code_line_ranges),
+            repr(doc_info.capture_after_lines),
+        ]
+        return hash_bytes("\0".join(map(str, parts)).encode("utf-8"))
+
+    def load(self, key):
+        """Return the cached code object for *key*, or None."""
+        try:
+            with (self._path / (key + ".marshal")).open("rb") as file:
+                return marshal.load(file)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, key, code):
+        self._path.mkdir(parents=True, exist_ok=True)
+        path = self._path / (key + ".marshal")
+        with _util.atomic_write_cm(path) as tmp_path, \
+             tmp_path.open("wb") as file:
+            marshal.dump(code, file)
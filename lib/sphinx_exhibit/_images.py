@@ -0,0 +1,94 @@
+"""
+Encoding and lossless optimization of the images saved by the examples.
+
+Encoding a figure as PNG is a large part of the cost of saving it, so figures
+are only rendered in the main thread, and encoded in a background thread while
+the example keeps running.  Likewise, optimizing a PNG (trying every
+compression strategy of zlib) is much slower than saving it, so it is also
+done in the background, and the results are cached keyed on the decoded
+pixels (the PNGs that Matplotlib writes embed its version, so their bytes are
+not a good key).
+"""
+
+import io
+from pathlib import Path
+
+import matplotlib as mpl
+import numpy as np
+
+from . import _cache, _util
+
+
+class _PixelsRecorder(io.RawIOBase):
+    # savefig(format="rgba") writes the renderer's buffer in a single call.
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # Copy, as the renderer (and its buffer) are reused.
+        self.pixels = np.array(data)
+        return self.pixels.nbytes
+
+
+def render_rgba(fig, dpi):
+    """
+    Render *fig* as a (height, width, 4) uint8 array, or return None.
+
+    None is returned if Matplotlib is too old to pass the shape of the
+    rendered buffer to the file object (Matplotlib<3.1).
+    """
+    recorder = _PixelsRecorder()
+    fig.savefig(recorder, format="rgba", dpi=dpi)
+    return recorder.pixels if recorder.pixels.ndim == 3 else None
+
+
+def write_png(pixels, path, dpi, *, optimize=False, cache_dir=None):
+    """
+    Save *pixels* (as returned by `render_rgba`) to *path*, as ``savefig``
+    would have, then optionally optimize it (see `optimize_png`).
+    """
+    # Killed examples thus never leave partial images.
+    with _util.atomic_write_cm(path) as tmp_path:
+        mpl.image.imsave(
+            str(tmp_path), pixels, format="png", origin="upper", dpi=dpi)
+    if optimize:
+        optimize_png(path, cache_dir)
+
+
+def optimize_png(path, cache_dir=None):
+    """
+    Losslessly recompress the PNG at *path* in place.
+
+    Images with at most 256 distinct colors are converted to palette mode.  If
+    *cache_dir* is not None, the results are cached there.
+    """
+    # Matplotlib depends on Pillow since 3.3.
+    from PIL import Image
+
+    path = Path(path)
+    with Image.open(str(path)) as image:
+        image.load()
+    key = _cache.hash_bytes(
+        "{}:{}:".format(image.mode, image.size).encode("utf-8")
+        + image.tobytes())
+    cached_path = (Path(cache_dir, key + ".png") if cache_dir is not None
+                   else None)
+    if cached_path and cached_path.exists():
+        data = cached_path.read_bytes()
+    else:
+        colors = image.getcolors(256)
+        if colors is not None:
+            quantized = image.quantize(len(colors))
+            # Quantization is only lossless if the palette is exact.
+            if quantized.convert(image.mode).tobytes() == image.tobytes():
+                image = quantized
+        buf = io.BytesIO()
+        image.save(buf, "png", optimize=True)
+        data = buf.getvalue()
+        if cached_path:
+            cached_path.parent.mkdir(parents=True, exist_ok=True)
+            with _util.atomic_write_cm(cached_path) as tmp_path:
+                tmp_path.write_bytes(data)
+    if len(data) < path.stat().st_size:
+        path.write_bytes(data)
@@ -1,20 +1,29 @@
 # FIXME: Patch AbstractMovieWriter.saving.
 
 import ast
-from collections import ChainMap, namedtuple
+import builtins
+from collections import namedtuple
+import concurrent.futures
 import contextlib
 import copy
+import cProfile
 from enum import Enum
 import functools
 import html
+import importlib
+import io
 import itertools
-from lib2to3 import pygram
+import multiprocessing
 import os
+import pickle
 import re
 from pathlib import Path
 import shutil
+import sys
 import textwrap
+import time
 import tokenize
+import traceback
 from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
 import warnings
 
@@ -29,13 +38,31 @@ import nbformat.v4
 import sphinx
 from sphinx.builders.dummy import DummyBuilder
 from sphinx.environment import BuildEnvironment
+from sphinx.errors import NoUri
 from sphinx.transforms import SphinxTransform
 
-from . import _lib2to3_parser, _offset_annotator, _util, __version__
+from . import (
+    _cache, _images, _inventory, _offset_annotator, _output, _report,
+    _timing, _util,
+    __version__)
 
 
 plt.switch_backend("agg")
 _log = sphinx.util.logging.getLogger(__name__.split(".")[0])
+# Keywords that continue a compound statement at the top level.
+_continuation_keywords = {"elif", "else", "except", "finally"}
+# Image formats for which no thumbnails nor high-resolution variants are made.
+_vector_formats = {"eps", "pdf", "ps", "svg", "svgz"}
+# Names of the hooks inserted by the instrumentation (not valid identifiers,
+# so that they cannot clash with the example's).
+_name_func_name = "!sphinx_exhibit_name"
+_attr_func_name = "!sphinx_exhibit_attr"
+_export_func_name = "!sphinx_exhibit_export"
+_seen_name = "!sphinx_exhibit_seen"
+# Added to the head of post-processed pages, so that they are not processed
+# twice.
+_postprocessed_meta_name = "sphinx-exhibit-postprocessed"
+_written_docs_name = "exhibit-written-docs.txt"
 _deletion_notice = """\
 .. This file was autogenerated by sphinx-exhibit, and will be deleted in the
    next build.
@@ -52,62 +79,231 @@ class Style(Enum):
     None_ = "none"
 
 
+class Layout(Enum):
+    Toctree = "toctree"
+    Gallery = "gallery"
+
+
+class Tracing(Enum):
+    All = "all"  # Record every object seen at each offset.
+    First = "first"  # Only record the first object seen at each offset.
+
+
 State = namedtuple("State", "stage docnames backrefs")
+# Per-document entry of the index of exhibit directives, stored in the env.
+# *blocks* is a list of (lineno, text) of the topmost blocks containing an
+# exhibit directive.
+IndexEntry = namedtuple("IndexEntry", "mtime size generated blocks")
+# How the figures are saved.  *srcset* lists the pixel densities (relative to
+# *dpi*) of the high-resolution variants to save in addition to each figure.
+ImageSettings = namedtuple("ImageSettings", "format dpi srcset optimize")
+# What execute_exhibit needs to know about the build; must be picklable.
+# *output_lines* is None or the (head, tail) numbers of output lines to keep
+# per block.
+ExecutionContext = namedtuple(
+    "ExecutionContext",
+    "srcdir project_root tracing docref_cache_size cache_dir profile_dir "
+    "output_lines output_spill")
+# Resource usage of an example.  *max_rss* is the peak RSS of the process that
+# ran it (and thus includes the previous examples run in that process), in
+# bytes, or None if unavailable.
+ExecutionStats = namedtuple(
+    "ExecutionStats", "wall_time cpu_time max_rss figures output_size")
 
 
 class DocInfo:
     def __init__(self):
         self.src_path = None
+        self.src_hash = None
+        self.syntax_style = None
         self.code_line_ranges = None
         self.capture_after_lines = []
         self.output_style = None
         self.rst = None
         self.skip = False
+        self.declared_files = []
+        # Overrides of exhibit_timeout and exhibit_memory_limit.
+        self.timeout = None
+        self.memory_limit = None
+        # The document containing the exhibit directive.
+        self.parent_docname = None
+        # The document containing the gallery grid, if any.
+        self.gallery_docname = None
+        self.image_settings = None
+        self.executed = False
+        # Whether the execution was killed (the outputs are then partial).
+        self.interrupted = False
+        self.imported_files = set()
+        # Maps the imported and declared files to their hashes, as of when
+        # the example was run.
+        self.dependency_hashes = {}
+        self.docref_cache_info = None
         self.outputs = []
+        # Per block, the file holding the full output if it was truncated.
+        self.output_files = []
         self.artefacts = []
+        # Maps artefacts to lists of (density, path) of their variants.
+        self.srcsets = {}
         self.annotations = {}
+        self.stats = None
+        # Maps stages to the time spent in them, while executing.
+        self.timings = {}
+        self.resolved_annotations = None  # Filled by resolve_docrefs.
+
+    def copy_source_info(self):
+        """Copy the info derived from the source, but not the outputs."""
+        info = DocInfo()
+        for attr in ["src_path", "src_hash", "syntax_style",
+                     "code_line_ranges", "capture_after_lines", "output_style",
+                     "rst", "skip", "declared_files", "timeout",
+                     "memory_limit"]:
+            setattr(info, attr, getattr(self, attr))
+        return info
+
+    def iter_saved_files(self):
+        """Yield the paths (relative to srcdir) of the files saved."""
+        for block in self.artefacts:
+            yield from block
+        yield from filter(None, self.output_files)
+        for variants in self.srcsets.values():
+            for _, path in variants:
+                yield path
 
     def merge(self, other):  # For reloading old info and for parallel builds.
-        assert not (self.artefacts and other.artefacts
-                    or self.annotations and other.annotations)
-        self.artefacts = self.artefacts or other.artefacts
-        self.annotations = self.annotations or other.annotations
+        if self.executed:
+            # Already filled in the main process, before forking the readers.
+            return
+        self.executed = other.executed
+        self.interrupted = other.interrupted
+        self.imported_files = other.imported_files
+        self.dependency_hashes = other.dependency_hashes
+        self.docref_cache_info = other.docref_cache_info
+        self.outputs = other.outputs
+        self.output_files = other.output_files
+        self.artefacts = other.artefacts
+        self.srcsets = other.srcsets
+        self.annotations = other.annotations
+        self.stats = other.stats
+        self.timings = other.timings
+        self.resolved_annotations = other.resolved_annotations
+
+
+def index_source(path, stat):
+    contents = path.read_text()
+    if contents.startswith(_deletion_notice):
+        return IndexEntry(stat.st_mtime_ns, stat.st_size, True, [])
+    # Only keep the topmost blocks (starting at column 0 and extending to the
+    # next line starting at column 0) containing an exhibit directive, so that
+    # e.g. directives shown in literal blocks are not run.
+    lines = contents.splitlines(keepends=True)
+    blocks = []
+    start = 0
+    has_exhibit = False
+    for lineno, line in enumerate([*lines, "EOF"]):
+        if line.strip() and not line[0].isspace():
+            if has_exhibit:
+                blocks.append((start, "".join(lines[start:lineno])))
+            start = lineno
+            has_exhibit = False
+        if re.search(r"\.\.\s+exhibit::\n", line):
+            has_exhibit = True
+    return IndexEntry(stat.st_mtime_ns, stat.st_size, False, blocks)
+
+
+def get_blocks_source(blocks):
+    # Pad with empty lines, to keep linenos in error messages correct.
+    parts = []
+    cur_lineno = 0
+    for lineno, text in blocks:
+        parts.extend(["\n" * (lineno - cur_lineno), text])
+        cur_lineno = lineno + text.count("\n")
+    return "".join(parts)
 
 
 def builder_inited(app):
+    with contextlib.suppress(FileNotFoundError):
+        Path(app.doctreedir, _written_docs_name).unlink()
+    app.exhibit_timings = _timing.Timings(app)
     env = BuildEnvironment(app)
-    env.exhibit_state = State(Stage.RstGeneration, {}, {})
+    env.exhibit_prev_state = \
+        getattr(app.env, "exhibit_state", State(None, {}, {}))
+    # The backrefs are updated incrementally by resolve_docrefs.
+    env.exhibit_state = State(
+        Stage.RstGeneration, {}, env.exhibit_prev_state.backrefs)
     env.find_files(app.config, DummyBuilder(app))
-    exhibits = []
+    # Unchanged documents (per mtime and size) are not read again.
+    prev_index = getattr(app.env, "exhibit_index", {})
+    env.exhibit_index = {}
+    env.exhibit_unchanged_docs = set()
     for docname in env.found_docs:
         path = Path(env.doc2path(docname))
-        contents = path.read_text()
-        if contents.startswith(_deletion_notice):
-            path.unlink()
-    # Generation must happen after all the unlinking is done.
+        stat = path.stat()
+        entry = prev_index.get(docname)
+        if (entry
+                and entry.mtime == stat.st_mtime_ns
+                and entry.size == stat.st_size):
+            env.exhibit_unchanged_docs.add(docname)
+        else:
+            entry = index_source(path, stat)
+        env.exhibit_index[docname] = entry
     rst.directives.register_directive("exhibit", Exhibit)
-    for docname in env.found_docs:
-        path = Path(env.doc2path(docname))
-        try:
-            contents = path.read_text()
-        except FileNotFoundError:  # Could have been deleted just above.
-            continue
-        if re.search(r"\.\.\s+exhibit::\n", contents):
+    for docname, entry in env.exhibit_index.items():
+        if entry.blocks:
             # state.document.current_source may lose track of the original
             # document (e.g. when generating contents with .. jinja::), so
             # stash the docname in the env.
             env.prepare_settings(docname)
             # FIXME: Add at least sphinx's default roles.
-            # FIXME: Only publish the topmost block containing the exhibit.
-            docutils.core.publish_doctree(
-                contents, source_path=path, settings_overrides={"env": env})
-    app.env.exhibit_prev_state = \
-        getattr(app.env, "exhibit_state", State(None, {}, {}))
+            with app.exhibit_timings.span("publish doctree", docname):
+                docutils.core.publish_doctree(
+                    get_blocks_source(entry.blocks),
+                    source_path=env.doc2path(docname),
+                    settings_overrides={"env": env})
+    # Generated documents are only rewritten if their contents changed (so
+    # that Sphinx doesn't consider them outdated); delete the others, and
+    # their thumbnails (also those of examples not in a gallery anymore).
+    index = {}
+    for docname, entry in env.exhibit_index.items():
+        if not entry.generated:
+            index[docname] = entry
+        elif docname not in env.exhibit_state.docnames:
+            Path(env.doc2path(docname)).unlink()
+            with contextlib.suppress(FileNotFoundError):
+                get_thumbnail_path(app.srcdir, docname).unlink()
+    for docname, doc_info in env.exhibit_state.docnames.items():
+        if not doc_info.gallery_docname:
+            with contextlib.suppress(FileNotFoundError):
+                get_thumbnail_path(app.srcdir, docname).unlink()
+    for docname in env.exhibit_state.docnames:
+        stat = Path(env.doc2path(docname)).stat()
+        index[docname] = IndexEntry(stat.st_mtime_ns, stat.st_size, True, [])
+    app.env.exhibit_index = index
+    # Documents whose exhibit directives now generate different examples must
+    # be read again, to update their toctrees.  (Otherwise, e.g. removing an
+    # example would not cause any document to be read, and the environment,
+    # including the exhibit state, would not be pickled.)
+    prev_children = get_children(env.exhibit_prev_state)
+    children = get_children(env.exhibit_state)
+    app.env.exhibit_outdated_parents = {
+        docname for docname in prev_children.keys() | children.keys()
+        if prev_children.get(docname) != children.get(docname)
+        and docname in env.found_docs}
+    app.env.exhibit_prev_state = env.exhibit_prev_state
     app.env.exhibit_state = \
         env.exhibit_state._replace(stage=Stage.ExhibitExecution)
+    if (app.builder.format == "html"
+            and any(doc_info.gallery_docname
+                    for doc_info in app.env.exhibit_state.docnames.values())):
+        app.config.html_static_path.append(
+            str(Path(__file__).with_name("_static")))
+        app.add_css_file("sphinx-exhibit.css")
     # Public directives.
     rst.directives.register_directive("exhibit-skip", ExhibitSkip)
     rst.directives.register_directive("exhibit-capture", ExhibitCapture)
+    rst.directives.register_directive("exhibit-depends", ExhibitDepends)
+    rst.directives.register_directive("exhibit-timeout", ExhibitTimeout)
+    rst.directives.register_directive(
+        "exhibit-memory-limit", ExhibitMemoryLimit)
     # Internal use.
     rst.directives.register_directive("exhibit-source", ExhibitSource)
     rst.directives.register_directive("exhibit-block", ExhibitBlock)
@@ -117,37 +313,94 @@ def builder_inited(app):
     app.add_post_transform(TransformExhibitBackrefs)
 
 
+def get_children(state):
+    """Map the documents containing exhibits to the examples they generate."""
+    children = {}
+    for docname, doc_info in state.docnames.items():
+        children.setdefault(doc_info.parent_docname, set()).add(docname)
+    return children
+
+
+def env_get_outdated(app, env, added, changed, removed):
+    # Sphinx<3 passes the builder instead of the env.
+    return sorted(app.env.exhibit_outdated_parents - removed)
+
+
 def split_text_and_code_blocks(src):
-    tree = _lib2to3_parser.parse(src)  # FIXME: Perhaps rewrite using tokenize.
+    src += "\n"
+    line_offsets = [0, 0]  # Linenos are 1-based.
+    for line in io.StringIO(src):
+        line_offsets.append(line_offsets[-1] + len(line))
+
+    def _to_offset(pos):
+        lineno, col = pos
+        return line_offsets[lineno] + col
 
     def _inner():
-        for i, node in enumerate(tree.children):
-            if (node.type == pygram.python_symbols.simple_stmt
-                    and node.children[0].type == pygram.token.STRING
+        # Each top-level statement spans from its first token to its final
+        # NEWLINE or, for compound statements, to the DEDENT back to the top
+        # level (thus including the comments trailing the last block).
+        depth = 0
+        at_line_start = True  # At the start of a logical line.
+        is_decorator = False
+        stmt = None  # [first_token, bare_string_token, end_offset]
+
+        def _finish():
+            first, string, end = stmt
+            if (string
                     # Exclude b- or f-strings, but not r-strings.
-                    and not re.search(
-                        r"""\A[^'"]*[bBfF]""", node.children[0].value)):
-                # This is never the last node.
-                tree.children[i + 1].prefix = (
-                    node.prefix + tree.children[i + 1].prefix)
-                yield ("text",
-                       ast.literal_eval(
-                           "".join(leaf.value for leaf in node.leaves())),
-                       node.get_lineno())
+                    and not re.search(r"""\A[^'"]*[bBfF]""", string.string)):
+                return ("text", ast.literal_eval(string.string),
+                        first.start[0])
+            else:
+                return ("code", (_to_offset(first.start), end),
+                        first.start[0])
+
+        for token in tokenize.generate_tokens(io.StringIO(src).readline):
+            if token.type == tokenize.INDENT:
+                depth += 1
+            elif token.type == tokenize.DEDENT:
+                depth -= 1
+                if depth == 0:
+                    stmt[2] = _to_offset(token.start)
+            elif token.type == tokenize.NEWLINE:
+                at_line_start = True
+                if depth == 0:
+                    stmt[2] = _to_offset(token.end)
+            elif token.type in [tokenize.COMMENT, tokenize.NL]:
+                pass
+            elif token.type == tokenize.ENDMARKER:
+                if stmt:
+                    yield _finish()
+                # Trailing comments are attached to the end of the source.
+                yield "code", (len(src), len(src)), token.start[0]
+            elif at_line_start:
+                at_line_start = False
+                if depth == 0:
+                    if not (is_decorator
+                            or token.type == tokenize.NAME
+                            and token.string in _continuation_keywords):
+                        if stmt:
+                            yield _finish()
+                        stmt = [token,
+                                token if token.type == tokenize.STRING
+                                else None,
+                                None]
+                    is_decorator = token.exact_type == tokenize.AT
             else:
-                yield ("code", node, node.get_lineno())
+                stmt[1] = None  # Not a bare string statement.
 
     for tp, it_group in itertools.groupby(_inner(), lambda kv: kv[0]):
-        _, strs_or_nodes, linenos = zip(*it_group)
+        _, strs_or_spans, linenos = zip(*it_group)
         if tp == "text":
-            string = "".join(strs_or_nodes)
+            string = "".join(strs_or_spans)
         elif tp == "code":
-            nodes = [*strs_or_nodes]
             # Extra newlines at the beginning or the end would be dropped
             # during the rst parsing, so drop them.  Also, extra newlines at
-            # the beginning would invalidate node.get_lineno().
-            nodes[0].prefix = ""
-            string = "".join(map(str, nodes)).rstrip("\n") + "\n"
+            # the beginning would invalidate the lineno.  Comments preceding
+            # the first statement are dropped as well.
+            string = (src[strs_or_spans[0][0]:strs_or_spans[-1][1]]
+                      .rstrip("\n") + "\n")
         else:
             assert False
         yield tp, string, linenos[0]
@@ -157,17 +410,254 @@ def env_before_read_docs(app, env, docnames):
     for docname, doc_info in env.exhibit_state.docnames.items():
         prev_info = env.exhibit_prev_state.docnames.get(docname)
         if (prev_info
+                and not prev_info.interrupted
                 and doc_info.rst == prev_info.rst
+                and doc_info.image_settings == prev_info.image_settings
+                and all(_cache.hash_file(path) == digest
+                        for path, digest
+                        in prev_info.dependency_hashes.items())
                 and all(Path(app.env.srcdir, path).exists()
-                        for block in prev_info.artefacts
-                        for path in block)):
+                        for path in prev_info.iter_saved_files())):
             doc_info.merge(prev_info)
-            docnames.remove(docname)
+            if docname in docnames:
+                docnames.remove(docname)
+        elif docname not in docnames:
+            # Not rewritten, but must be run again (e.g., because the
+            # artefacts were deleted).
+            docnames.append(docname)
     # Exhibits need to be run first because other docs may refer to the
     # resulting plots.
     docnames[:] = sorted(
         docnames,
         key=lambda docname: 0 if docname in env.exhibit_state.docnames else 1)
+    execute_exhibits(
+        app, [docname for docname in docnames
+              if docname in env.exhibit_state.docnames])
+    # Thumbnails are regenerated for the examples that are read again, and
+    # restored if missing.
+    gallery_examples = [
+        docname for docname, doc_info in env.exhibit_state.docnames.items()
+        if doc_info.gallery_docname
+        and (docname in docnames
+             or any(doc_info.artefacts)
+             and not get_thumbnail_path(app.srcdir, docname).exists())]
+    with app.exhibit_timings.span("thumbnail generation"):
+        make_thumbnails(app, gallery_examples)
+    # The grids must be read again, as Sphinx checked the timestamps of the
+    # images that they include before the thumbnails were updated.
+    for docname in gallery_examples:
+        gallery_docname = env.exhibit_state.docnames[docname].gallery_docname
+        if gallery_docname not in docnames:
+            docnames.append(gallery_docname)
+
+
+def get_execution_context(app):
+    project_root = app.config.exhibit_project_root
+    output_lines = app.config.exhibit_output_lines
+    if isinstance(output_lines, str):  # Overridden from the command line.
+        output_lines = output_lines.split(",")
+    return ExecutionContext(
+        srcdir=Path(app.srcdir),
+        project_root=(Path(app.confdir, project_root).resolve()
+                      if project_root is not None else
+                      Path(app.confdir).resolve().parent),
+        tracing=Tracing(app.config.exhibit_tracing),
+        docref_cache_size=app.config.exhibit_docref_cache_size,
+        cache_dir=get_cache_dir(app),
+        profile_dir=(Path(app.confdir, app.config.exhibit_profile_dir)
+                     if app.config.exhibit_profile_dir is not None else
+                     None),
+        output_lines=(tuple(map(int, output_lines))
+                      if output_lines is not None else None),
+        output_spill=bool(app.config.exhibit_output_spill))
+
+
+def get_cache_dir(app):
+    cache_dir = app.config.exhibit_cache_dir
+    if cache_dir is False:
+        return None
+    return (Path(app.confdir, cache_dir) if cache_dir is not None else
+            Path(app.doctreedir, "exhibit-cache"))
+
+
+def get_execution_cache(app):
+    cache_dir = get_cache_dir(app)
+    if cache_dir is None:
+        return None
+    context = get_execution_context(app)
+    return _cache.ExecutionCache(
+        cache_dir, context.project_root,
+        settings=[context.tracing.value, context.output_lines,
+                  context.output_spill])
+
+
+def execute_exhibits(app, docnames):
+    """
+    Run the exhibits for the given docnames, possibly in parallel.
+
+    Results are restored from the execution cache when possible.  The read
+    phase then only needs to consume the stored results.
+    """
+    env = app.env
+    doc_infos = env.exhibit_state.docnames
+    context = get_execution_context(app)
+    cache = get_execution_cache(app)
+    cache_keys = {}
+    pending = []
+    for docname in docnames:
+        if cache:
+            cache_keys[docname] = key = cache.get_key(
+                docname, doc_infos[docname])
+            cached = cache.load(key, context.srcdir)
+            if cached:
+                _log.debug("restored %s from the execution cache.", docname)
+                doc_infos[docname].merge(cached)
+                continue
+        pending.append(docname)
+
+    def store_result(docname, result):
+        app.exhibit_timings.add_all(result.timings, docname)
+        doc_infos[docname].merge(result)
+        # Interrupted executions are not cached, so that they are retried.
+        if cache and not result.interrupted:
+            cache.store(cache_keys[docname], context.srcdir, result)
+
+    limits = {}
+    for docname in pending:
+        doc_info = doc_infos[docname]
+        timeout = (doc_info.timeout if doc_info.timeout is not None
+                   else float(app.config.exhibit_timeout)
+                   if app.config.exhibit_timeout is not None
+                   else None)
+        memory_limit = (
+            doc_info.memory_limit if doc_info.memory_limit is not None
+            else parse_size(app.config.exhibit_memory_limit)
+            if app.config.exhibit_memory_limit is not None
+            else None)
+        limits[docname] = timeout or None, memory_limit or None
+    # If limits are set, each example runs in its own subprocess, supervised
+    # by a thread of the main process.
+    supervised = any(timeout or memory_limit
+                     for timeout, memory_limit in limits.values())
+
+    # Forked subprocesses and workers inherit the preloaded modules; workers
+    # that are spawned instead load them once, when started.
+    preload_modules = app.config.exhibit_preload_modules
+    if pending:
+        _preload_modules(preload_modules)
+
+    jobs = app.config.exhibit_jobs
+    iter_docnames = functools.partial(
+        sphinx.util.status_iterator, length=len(pending))
+    if supervised or jobs > 1 and len(pending) > 1:
+        with (concurrent.futures.ThreadPoolExecutor(jobs) if supervised else
+              concurrent.futures.ProcessPoolExecutor(
+                  jobs, initializer=_preload_modules,
+                  initargs=(preload_modules,))) as executor:
+            futures = {
+                (executor.submit(execute_exhibit_supervised,
+                                 context, docname, doc_infos[docname],
+                                 *limits[docname], preload_modules)
+                 if supervised else
+                 executor.submit(_call_collecting_logs, execute_exhibit,
+                                 context, docname, doc_infos[docname])):
+                docname
+                for docname in pending}
+            for future in iter_docnames(
+                    concurrent.futures.as_completed(futures),
+                    "executing exhibits... ",
+                    stringify_func=futures.__getitem__):
+                logs, result = future.result()
+                for record in logs:
+                    _log.handle(record)
+                store_result(futures[future], result)
+    else:
+        for docname in iter_docnames(pending, "executing exhibits... "):
+            store_result(
+                docname, execute_exhibit(context, docname, doc_infos[docname]))
+    if pending:
+        cache_infos = [doc_infos[docname].docref_cache_info
+                       for docname in pending
+                       if doc_infos[docname].docref_cache_info]
+        _log.verbose("docref cache: %d hits, %d misses.",
+                     sum(info.hits for info in cache_infos),
+                     sum(info.misses for info in cache_infos))
+
+
+def _preload_modules(names):
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            _log.warning("failed to preload %s: %s", name, e)
+
+
+def get_thumbnail_path(srcdir, docname):
+    return Path(srcdir, docname + "-thumb.png")
+
+
+def make_thumbnails(app, docnames):
+    """
+    Generate the thumbnails of the given examples, possibly in parallel.
+
+    Each thumbnail is a downscaled copy of the first artefact of the example.
+    Thumbnails are stored in the cache directory, keyed on the contents of
+    the artefact, so that unchanged images are never encoded again.
+    """
+    doc_infos = app.env.exhibit_state.docnames
+    scale = app.config.exhibit_thumbnail_scale
+    cache_dir = get_cache_dir(app)
+    cached_paths = {}
+    pending = {}
+    for docname in docnames:
+        path = get_thumbnail_path(app.srcdir, docname)
+        artefact = next(
+            (path for path in itertools.chain.from_iterable(
+                doc_infos[docname].artefacts)
+             if path.suffix[1:] not in _vector_formats),
+            None)
+        if artefact is None:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+            continue
+        artefact = Path(app.srcdir, artefact)
+        if cache_dir is None:
+            pending[docname] = artefact, path
+            continue
+        key = _cache.hash_bytes("\0".join(
+            map(str, [_cache.hash_file(artefact), scale, mpl.__version__]))
+            .encode("utf-8"))
+        cached_path = cached_paths[docname] = \
+            cache_dir / "thumbnails" / (key + ".png")
+        if not cached_path.exists():
+            pending[docname] = artefact, cached_path
+
+    jobs = app.config.exhibit_jobs
+    iter_docnames = functools.partial(
+        sphinx.util.status_iterator, length=len(pending))
+    if jobs > 1 and len(pending) > 1:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = {
+                executor.submit(make_thumbnail, src, dest, scale): docname
+                for docname, (src, dest) in pending.items()}
+            for future in iter_docnames(
+                    concurrent.futures.as_completed(futures),
+                    "generating thumbnails... ",
+                    stringify_func=futures.__getitem__):
+                future.result()
+    else:
+        for docname in iter_docnames(pending, "generating thumbnails... "):
+            src, dest = pending[docname]
+            make_thumbnail(src, dest, scale)
+    for docname, cached_path in cached_paths.items():
+        _util.copy_if_changed(
+            cached_path, get_thumbnail_path(app.srcdir, docname))
+
+
+def make_thumbnail(src, dest, scale):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with _util.atomic_write_cm(dest) as tmp_path:
+        mpl.image.thumbnail(str(src), str(tmp_path), scale=scale)
 
 
 def doc_info_from_py_source(src_path, *, syntax_style, output_style):
@@ -211,8 +701,25 @@ def doc_info_from_py_source(src_path, *, syntax_style, output_style):
     code_line_ranges = []
     capture_after_lines = []
     block_counter = itertools.count()
+    skip = False
+    declared_files = []
+    timeout = None
+    memory_limit = None
     for tp, string, lineno in text_and_code_blocks:
         if tp == "text":
+            # Needed before the document is read, so that execution can be
+            # done in advance.
+            if re.search(r"^\s*\.\.\s+exhibit-skip::\s*$", string, re.M):
+                skip = True
+            declared_files.extend(re.findall(
+                r"^\s*\.\.\s+exhibit-depends::\s+(.*?)\s*$", string, re.M))
+            for arg in re.findall(
+                    r"^\s*\.\.\s+exhibit-timeout::\s+(.*?)\s*$", string, re.M):
+                timeout = float(arg)
+            for arg in re.findall(
+                    r"^\s*\.\.\s+exhibit-memory-limit::\s+(.*?)\s*$",
+                    string, re.M):
+                memory_limit = parse_size(arg)
             text_blocks.extend([
                 string,
                 ".. raw:: html\n\n"
@@ -244,13 +751,32 @@ def doc_info_from_py_source(src_path, *, syntax_style, output_style):
     rst_source = "\n\n".join(text_blocks)
     doc_info = DocInfo()
     doc_info.src_path = src_path
+    doc_info.syntax_style = syntax_style
     doc_info.code_line_ranges = code_line_ranges
     doc_info.capture_after_lines = capture_after_lines
     doc_info.output_style = output_style
     doc_info.rst = rst_source
+    doc_info.skip = skip
+    doc_info.declared_files = declared_files
+    doc_info.timeout = timeout
+    doc_info.memory_limit = memory_limit
     return doc_info
 
 
+def parse_size(arg):
+    """Parse a size in bytes, with an optional K, M, or G (binary) suffix."""
+    match = re.fullmatch(r"(\d+(?:\.\d*)?)\s*([KMG]?)", str(arg).strip(), re.I)
+    if not match:
+        raise ValueError("Invalid size: {!r}".format(arg))
+    return int(float(match.group(1))
+               * 1024 ** " KMG".index(match.group(2).upper() or " "))
+
+
+def parse_srcset(arg):
+    """Parse a list of pixel densities, separated by commas or whitespace."""
+    return tuple(float(density) for density in arg.replace(",", " ").split())
+
+
 class SourceGetterMixin(rst.Directive):
     def get_current_source(self):
         env = self.state.document.settings.env
@@ -302,6 +828,10 @@ class Exhibit(SourceGetterMixin):
             destdir: Path = os.curdir,
             syntax_style: Style = None,
             output_style: Style = None,
+            layout: Layout = None,
+            image_format: str = None,
+            image_dpi: float = None,
+            image_srcset: parse_srcset = None,
             ):
         env = self.state.document.settings.env
         if syntax_style is None:
@@ -310,41 +840,96 @@ class Exhibit(SourceGetterMixin):
         if output_style is None:
             output_style = self.options["output-style"] = \
                 Style(env.config.exhibit_output_style)
+        if layout is None:
+            layout = self.options["layout"] = \
+                Layout(env.config.exhibit_layout)
+        if image_format is None:
+            image_format = self.options["image-format"] = \
+                env.config.exhibit_image_format
+        if image_dpi is None and env.config.exhibit_image_dpi is not None:
+            image_dpi = self.options["image-dpi"] = \
+                float(env.config.exhibit_image_dpi)
+        if image_srcset is None:
+            # Overrides from the command line are lists of strs.
+            image_srcset = self.options["image-srcset"] = \
+                tuple(map(float, env.config.exhibit_image_srcset))
 
         e_state = env.exhibit_state
         if e_state.stage is Stage.RstGeneration:
-            for src_path, docname in self.get_src_paths_and_docnames():
-                dest_path = Path(env.doc2path(docname))
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                doc_info = doc_info_from_py_source(
-                    src_path,
-                    syntax_style=self.options["syntax-style"],
-                    output_style=self.options["output-style"])
-                dest_path.write_text(doc_info.rst)
-                # NOTE: We don't actually need this source; it is only copied
-                # for compat with s-g and its use by the .. plot:: directive.
-                # FIXME: Also arrange to delete this file.
-                shutil.copyfile(str(src_path),
-                                str(dest_path.parent / src_path.name))
-                e_state.docnames[docname] = doc_info
+            timings = env.app.exhibit_timings
+            with timings.span("glob expansion", env.docname):
+                src_paths_and_docnames = self.get_src_paths_and_docnames()
+            for src_path, docname in src_paths_and_docnames:
+                with timings.span("rst generation", docname):
+                    self.generate_rst(
+                        src_path, docname, syntax_style, output_style,
+                        layout, image_format, image_dpi, image_srcset)
             return []
         else:  # Read stage, either ExhibitExecution or ExecutionDone.
-            cur_dir = self.get_current_source().parent
+            docnames = [
+                docname for _, docname in self.get_src_paths_and_docnames()]
             lines = ([".. toctree::",
-                      "   :titlesonly:",
-                      ""] +
-                     ["   /{}".format(docname)
-                      for _, docname in self.get_src_paths_and_docnames()])
+                      "   :titlesonly:"] +
+                     (["   :hidden:"] if layout is Layout.Gallery else []) +
+                     [""] +
+                     ["   /{}".format(docname) for docname in docnames])
+            if layout is Layout.Gallery:
+                lines.extend(["", ".. container:: sphinx-exhibit-gallery", ""])
+                for docname in docnames:
+                    lines.extend(["   .. container:: sphinx-exhibit-thumbnail",
+                                  ""])
+                    if get_thumbnail_path(env.srcdir, docname).exists():
+                        lines.extend([
+                            "      .. image:: /{}-thumb.png".format(docname),
+                            "         :alt: {}".format(docname),
+                            ""])
+                    lines.extend(["      :doc:`/{}`".format(docname), ""])
             node = rst.nodes.Element()
             self.state.nested_parse(ViewList(lines), 0, node)
             return node.children
 
+    def generate_rst(self, src_path, docname, syntax_style, output_style,
+                     layout, image_format, image_dpi, image_srcset):
+        env = self.state.document.settings.env
+        dest_path = Path(env.doc2path(docname))
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        src_hash = _cache.hash_file(src_path)
+        prev_info = env.exhibit_prev_state.docnames.get(docname)
+        # The rst embeds the source path, which may change without the
+        # contents (e.g., if the examples are moved).
+        if (prev_info
+                and prev_info.src_path == src_path
+                and prev_info.src_hash == src_hash
+                and prev_info.syntax_style is syntax_style
+                and prev_info.output_style is output_style):
+            doc_info = prev_info.copy_source_info()
+        else:
+            doc_info = doc_info_from_py_source(
+                src_path,
+                syntax_style=syntax_style,
+                output_style=output_style)
+            doc_info.src_hash = src_hash
+        doc_info.parent_docname = env.docname
+        doc_info.gallery_docname = (
+            env.docname if layout is Layout.Gallery else None)
+        doc_info.image_settings = ImageSettings(
+            image_format, image_dpi, image_srcset,
+            env.config.exhibit_image_optimize)
+        # The index entry is unchanged iff the file was not modified since it
+        # was written with prev_info.rst.
+        if not (docname in env.exhibit_unchanged_docs
+                and env.exhibit_index[docname].generated
+                and prev_info and prev_info.rst == doc_info.rst):
+            _util.write_if_changed(dest_path, doc_info.rst)
+        # NOTE: We don't actually need this source; it is only copied for
+        # compat with s-g and its use by the .. plot:: directive.
+        # FIXME: Also arrange to delete this file.
+        _util.copy_if_changed(src_path, dest_path.parent / src_path.name)
+        env.exhibit_state.docnames[docname] = doc_info
+
 
 class ExhibitSkip(SourceGetterMixin):
-    def run(self):
-        env = self.state.document.settings.env
-        doc_info = env.exhibit_state.docnames[env.docname]
-        doc_info.skip = True
+    def run(self):  # Already handled by doc_info_from_py_source.
         return []
 
 
@@ -354,8 +939,31 @@ class ExhibitCapture(SourceGetterMixin):
         return []
 
 
+class ExhibitDepends(SourceGetterMixin):
+    @_util.directive_runner(final_argument_whitespace=True)
+    def run(self, path: Path):  # Already handled by doc_info_from_py_source.
+        return []
+
+
+class ExhibitTimeout(SourceGetterMixin):
+    # Already handled by doc_info_from_py_source.
+    @_util.directive_runner()
+    def run(self, timeout: float):
+        return []
+
+
+class ExhibitMemoryLimit(SourceGetterMixin):
+    # Already handled by doc_info_from_py_source.
+    @_util.directive_runner()
+    def run(self, size: parse_size):
+        return []
+
+
 DocRef = namedtuple("DocRef", "role lookups")
 Annotation = namedtuple("Annotation", "docrefs href")
+# The href of annotations resolved to local objects, which does not depend on
+# the builder; it is turned into a URI when writing.
+LocalTarget = namedtuple("LocalTarget", "docname anchor")
 
 
 def get_docref(obj, source_name, parent=None):
@@ -389,168 +997,569 @@ def get_docref(obj, source_name, parent=None):
             "Named module-level object of unknown type: {!r}".format(obj))
 
 
-class ExhibitSource(SourceGetterMixin):
+CacheInfo = namedtuple("CacheInfo", "hits misses maxsize currsize")
+
+
+class DocrefCache:
+    """
+    A bounded memo of the objects whose docrefs were already recorded.
+
+    Entries are keyed on the offset and on the ids of the objects that
+    determine the docref, and hold these objects so that their ids cannot be
+    reused while the entry exists.  These are the object itself, or for bound
+    methods (which are new objects on each access), their function (or for
+    builtins, the type of their instance); and the parent only for module
+    attributes.  Thus, instances (which may be large temporaries) are never
+    kept alive.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
     @staticmethod
-    @contextlib.contextmanager
-    def _patch_mpl_interactivity():
-        FigureCanvasBase = mpl.backend_bases.FigureCanvasBase
-        FigureManagerBase = mpl.backend_bases.FigureManagerBase
-        start_event_loop = FigureCanvasBase.start_event_loop
-        show = mpl.backend_bases.FigureManagerBase.show
-        FigureCanvasBase.start_event_loop = lambda self, timeout=0: None
-        FigureManagerBase.show = lambda self: None
-        try:
-            yield
-        finally:
-            FigureCanvasBase.start_event_loop = start_event_loop
-            FigureManagerBase.show = show
+    def _get_key(offset, obj, parent):
+        """Return the key for *obj*, and the objects that it refers to."""
+        if not isinstance(parent, ModuleType):
+            parent = None
+        name = None
+        if isinstance(obj, MethodType):
+            obj = obj.__func__
+        elif (isinstance(obj, BuiltinFunctionType)
+              and obj.__self__ is not None
+              and not isinstance(obj.__self__, (ModuleType, type))):
+            obj, name = type(obj.__self__), obj.__name__
+        return (offset, id(obj), id(parent), name), (obj, parent)
+
+    def check(self, offset, obj, parent=None):
+        key, referents = self._get_key(offset, obj, parent)
+        entry = self._entries.get(key)
+        if (entry is not None
+                and entry[0] is referents[0] and entry[1] is referents[1]):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, offset, obj, parent=None):
+        if not self.maxsize:
+            return
+        if len(self._entries) >= self.maxsize:
+            del self._entries[next(iter(self._entries))]  # The oldest entry.
+        key, referents = self._get_key(offset, obj, parent)
+        self._entries[key] = referents
+
+    def cache_info(self):
+        return CacheInfo(
+            self.hits, self.misses, self.maxsize, len(self._entries))
+
 
+class ExhibitSource(SourceGetterMixin):
     @_util.directive_runner(final_argument_whitespace=True)
     def run(self, src_path: Path):
         env = self.state.document.settings.env
-        if env.exhibit_state.stage is Stage.ExecutionDone:
-            _log.warning(
-                "Handling %s after docrefs have already been resolved.")
-
         doc_info = env.exhibit_state.docnames[env.docname]
-        doc_info.artefacts = [[] for _ in doc_info.capture_after_lines]
-        doc_info.outputs = ["" for _ in doc_info.capture_after_lines]
-        if doc_info.skip or doc_info.output_style is Style.None_:
-            return []
+        if not doc_info.executed:
+            # Normally already done by execute_exhibits, but Sphinx may decide
+            # to read additional documents after env-before-read-docs.
+            if env.exhibit_state.stage is Stage.ExecutionDone:
+                _log.warning(
+                    "Handling %s after docrefs have already been resolved.",
+                    env.docname)
+            doc_info.merge(execute_exhibit(
+                get_execution_context(env.app), env.docname, doc_info))
+        return []
+
+
+@contextlib.contextmanager
+def _patch_mpl_interactivity():
+    FigureCanvasBase = mpl.backend_bases.FigureCanvasBase
+    FigureManagerBase = mpl.backend_bases.FigureManagerBase
+    start_event_loop = FigureCanvasBase.start_event_loop
+    show = mpl.backend_bases.FigureManagerBase.show
+    FigureCanvasBase.start_event_loop = lambda self, timeout=0: None
+    FigureManagerBase.show = lambda self: None
+    try:
+        yield
+    finally:
+        FigureCanvasBase.start_event_loop = start_event_loop
+        FigureManagerBase.show = show
+
+
+def _call_collecting_logs(func, *args):
+    # Worker processes cannot log directly, so ship the records back to the
+    # main process (as sphinx.util.parallel does).
+    collector = sphinx.util.logging.LogCollector()
+    with collector.collect():
+        result = func(*args)
+    sphinx.util.logging.convert_serializable(collector.logs)
+    return collector.logs, result
+
+
+def execute_exhibit_supervised(
+        context, docname, doc_info, timeout, memory_limit,
+        preload_modules=()):
+    """
+    Run `execute_exhibit` in a subprocess, killing it after *timeout* seconds
+    and capping its address space to *memory_limit* bytes (either can be
+    None).
+
+    Return the logs and the result, as `_call_collecting_logs` does.  If the
+    subprocess was killed (or died, or failed outside of the example), the
+    result holds the outputs and artefacts of the blocks that completed, and
+    is marked as interrupted.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_run_supervised,
+        args=(sender, context, docname, doc_info, memory_limit,
+              preload_modules))
+    process.start()
+    sender.close()
+    result = DocInfo()
+    result.executed = True
+    result.interrupted = True
+    result.artefacts = [[] for _ in doc_info.capture_after_lines]
+    result.outputs = ["" for _ in doc_info.capture_after_lines]
+    result.output_files = [None for _ in doc_info.capture_after_lines]
+    deadline = time.monotonic() + timeout if timeout else None
+    logs = []
+    try:
+        while True:
+            remaining = (max(deadline - time.monotonic(), 0)
+                         if deadline else None)
+            if not receiver.poll(remaining):
+                reason = "timed out after {:g}s".format(timeout)
+                break
+            try:
+                msg = receiver.recv()
+            except EOFError:
+                reason = "died"
+                break
+            if msg[0] == "done":
+                _, logs, done = msg
+                process.join()
+                if done is not None:
+                    return logs, done
+                reason = "failed"
+                break
+            _, block_idx, output, output_file, artefacts, srcsets = msg
+            result.outputs[block_idx] = output
+            result.output_files[block_idx] = output_file
+            result.artefacts[block_idx] = artefacts
+            result.srcsets.update(srcsets)
+    finally:
+        receiver.close()
+    process.kill()
+    process.join()
+    _log.warning("%s %s; keeping the outputs of the completed blocks.",
+                 docname, reason)
+    # Images are written atomically, but possibly not yet.
+    result.artefacts = [
+        [path for path in block if Path(context.srcdir, path).exists()]
+        for block in result.artefacts]
+    result.srcsets = {
+        artefact: variants for artefact, variants in result.srcsets.items()
+        if all(Path(context.srcdir, path).exists() for _, path in variants)}
+    # The spill files of the completed blocks were flushed; the others are
+    # deleted.
+    for block_idx, output_file in enumerate(result.output_files):
+        if output_file is None:
+            with contextlib.suppress(FileNotFoundError):
+                get_spill_path(context.srcdir, docname, block_idx).unlink()
+    return logs, result
+
+
+def get_spill_path(srcdir, docname, block_idx):
+    """Return the path of the file holding the full output of a block."""
+    return Path(srcdir, "{}-{}-output.txt".format(docname, block_idx))
+
+
+def _run_supervised(
+        sender, context, docname, doc_info, memory_limit, preload_modules):
+    _preload_modules(preload_modules)  # No-op, unless spawned.
+    if memory_limit:
+        try:
+            import resource
+        except ImportError:  # Windows.
+            _log.warning("Memory limits are not supported on this platform.")
+        else:
+            resource.setrlimit(
+                resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    def send_block(block_idx, output, output_file, artefacts, srcsets):
+        sender.send(
+            ("block", block_idx, output, output_file, artefacts, srcsets))
 
-        mod = _offset_annotator.parse(
-            src_path,
-            [idx for code_line_range in doc_info.code_line_ranges
-             for idx in code_line_range])
-
-        # Rewrite (Load context only):
-        # - foo
-        #   -> _sphinx_exhibit_name_(foo, "foo", offset)
-        # - foo.bar
-        #   -> _sphinx_exhibit_attr_(foo, "bar", offset)
-
-        name_func_name = "!sphinx_exhibit_name"
-        attr_func_name = "!sphinx_exhibit_attr"
-        export_func_name = "!sphinx_exhibit_export"
-
-        class Transformer(ast.NodeTransformer):
-            def visit_Name(self, node):
-                return (
-                    ast.fix_missing_locations(ast.copy_location(
-                        ast.Call(
-                            ast.Name(name_func_name, ast.Load()),
-                            [node, ast.Str(node.id), ast.Num(node.offset)],
-                            []),
-                        node))
-                    if type(node.ctx) == ast.Load else
+    def run():
+        # Errors outside of the example itself (e.g., when compiling it) are
+        # reported to the supervisor, rather than just killing the process.
+        try:
+            return execute_exhibit(context, docname, doc_info, send_block)
+        except Exception:
+            _log.warning("%s could not be run:\n%s",
+                         docname, traceback.format_exc().rstrip())
+            return None
+
+    logs, result = _call_collecting_logs(run)
+    sender.send(("done", logs, result))
+
+
+def compile_exhibit(context, doc_info):
+    """
+    Compile the source of *doc_info*, instrumented to record the objects that
+    its names refer to and to export the figures after each block.
+    """
+    src_path = doc_info.src_path
+    mod = _offset_annotator.parse(
+        src_path,
+        [idx for code_line_range in doc_info.code_line_ranges
+         for idx in code_line_range])
+
+    # Rewrite (Load context only):
+    # - foo
+    #   -> _sphinx_exhibit_name_(foo, "foo", offset)
+    # - foo.bar
+    #   -> _sphinx_exhibit_attr_(foo, "bar", offset)
+    # With Tracing.First, the calls are additionally guarded:
+    # - foo
+    #   -> foo if offset in _sphinx_exhibit_seen_ else <call, as above>
+    # - foo.bar
+    #   -> foo.bar if offset in _sphinx_exhibit_seen_ else <call, as above>
+    # where the first branch is the original, uninstrumented expression, and
+    # offsets are added to the seen set once a docref was recorded for them
+    # (by then, all their subexpressions have also been instrumented once).
+
+    class Transformer(ast.NodeTransformer):
+        def _guard(self, plain, call, node):
+            if context.tracing is Tracing.First:
+                call = ast.IfExp(
+                    ast.Compare(ast.Constant(node.offset),
+                                [ast.In()],
+                                [ast.Name(_seen_name, ast.Load())]),
+                    plain,
+                    call)
+            return ast.fix_missing_locations(ast.copy_location(call, node))
+
+        def visit_Name(self, node):
+            return (
+                self._guard(
+                    copy.copy(node),
+                    ast.Call(
+                        ast.Name(_name_func_name, ast.Load()),
+                        [node, ast.Constant(node.id),
+                         ast.Constant(node.offset)],
+                        []),
                     node)
+                if type(node.ctx) == ast.Load else
+                node)
 
-            def visit_Attribute(self, node):
+        def visit_Attribute(self, node):
+            if type(node.ctx) != ast.Load:
                 self.generic_visit(node)
-                return (
-                    ast.fix_missing_locations(ast.copy_location(
-                        ast.Call(
-                            ast.Name(attr_func_name, ast.Load()),
-                            [node.value, ast.Str(node.attr), ast.Num(node.offset)],
-                            []),
-                        node))
-                    if type(node.ctx) == ast.Load else
-                    node)
+                return node
+            plain = (copy.deepcopy(node)
+                     if context.tracing is Tracing.First else None)
+            self.generic_visit(node)
+            return self._guard(
+                plain,
+                ast.Call(
+                    ast.Name(_attr_func_name, ast.Load()),
+                    [node.value, ast.Constant(node.attr),
+                     ast.Constant(node.offset)],
+                    []),
+                node)
+
+    mod = Transformer().visit(mod)
+
+    for lineno in doc_info.capture_after_lines:
+        inserted = ast.fix_missing_locations(
+            ast.Expr(
+                ast.Call(
+                    ast.Name(_export_func_name, ast.Load()),
+                    [], []),
+                lineno=lineno, end_lineno=lineno,
+                col_offset=0, end_col_offset=0))
+        mod.body.append(inserted)
+    mod.body.sort(key=lambda stmt: stmt.lineno)
+    return compile(mod, str(src_path), "exec")
+
+
+def execute_exhibit(context, docname, doc_info, block_callback=None):
+    """
+    Run the source of *doc_info*, which generates *docname*.
 
-        mod = Transformer().visit(mod)
+    Return a new `DocInfo` holding the outputs, artefacts and annotations (and
+    the project files imported by the example), to be merged into *doc_info*.
+    This does not need the build environment, and can thus run in a worker
+    process.
 
-        for lineno in doc_info.capture_after_lines:
-            inserted = ast.fix_missing_locations(
-                ast.Expr(
-                    ast.Call(
-                        ast.Name(export_func_name, ast.Load()),
-                        [], []),
-                    lineno=lineno))
-            mod.body.append(inserted)
-        mod.body.sort(key=lambda stmt: stmt.lineno)
-        code = compile(mod, str(src_path), "exec")
-
-        def sphinx_exhibit_name(obj, name, offset):
-            docref = get_docref(obj, name)
-            if docref:
-                (doc_info.annotations
-                 .setdefault(offset, Annotation(set(), None))
-                 .docrefs.add(docref))
-            return obj
-
-        def sphinx_exhibit_attr(obj, name, offset):
-            attr = getattr(obj, name)
-            docref = get_docref(attr, name, parent=obj)
-            if docref:
-                (doc_info.annotations
-                 .setdefault(offset, Annotation(set(), None))
-                 .docrefs.add(docref))
-            return attr
-
-        block_idx = 0
-        sg_base_num = 0
-        def sphinx_exhibit_export():
-            nonlocal block_idx, sg_base_num
-            for fig_idx, fignum in enumerate(plt.get_fignums()):
-                if doc_info.output_style is Style.Native:
-                    dest = Path(
-                        env.srcdir,
-                        "{}-{}-{}.png".format(env.docname, block_idx, fig_idx))
-                elif doc_info.output_style is Style.SG:
-                    dir_path = (env.srcdir
-                                / self.get_current_source().parent
-                                / "images")
-                    dir_path.mkdir(exist_ok=True)
-                    dest = Path(
-                        dir_path / "sphx_glr_{}_{:03}.png".format(
-                            Path(env.docname).name, sg_base_num + fignum))
-                else:
-                    assert False
-                doc_info.artefacts[block_idx].append(
-                    dest.relative_to(env.srcdir))
-                plt.figure(fignum).savefig(str(dest))
-            block_idx += 1
-            sg_base_num += len(plt.get_fignums())
-            # FIXME: Make this configurable?
-            plt.close("all")
-
-        class Stream:
-            def __init__(self):
-                self._writes = [[] for _ in range(len(doc_info.outputs))]
-
-            def write(self, s):
-                self._writes[block_idx].append(s)
-
-            def get_contents(self):
-                return ["".join(block) for block in self._writes]
-
-        stream = Stream()
-
-        # FIXME: chdir is only for s-g compatibility.
-        # FIXME: Also patch sys.argv.
-        # FIXME: runpy + override source_to_code in a custom importer.
-        # Prevent Matplotlib's cleanup decorator from destroying the warnings
-        # filters.
-        with self._patch_mpl_interactivity(), \
-             _util.chdir_cm(src_path.parent), \
-             warnings.catch_warnings(), \
-             contextlib.redirect_stdout(stream), \
-             contextlib.redirect_stderr(stream):
-            try:
-                mpl.testing.decorators.cleanup("default")(lambda: exec(
-                    code,
-                    {name_func_name: sphinx_exhibit_name,
-                     attr_func_name: sphinx_exhibit_attr,
-                     export_func_name: sphinx_exhibit_export,
-                     "__file__": str(src_path),
-                     "__name__": "__main__"}))()
-            except (Exception, SystemExit) as e:
-                _log.warning("%s raised %s: %s",
-                             env.docname, type(e).__name__, e)
-
-        doc_info.outputs = stream.get_contents()
+    If given, *block_callback* is called after each block with its index,
+    output, output file (see `DocInfo.output_files`), artefacts (which may still be being written) and `DocInfo.srcsets`
+    entries.
+    """
+    srcdir = context.srcdir
+    result = DocInfo()
+    result.executed = True
+    result.artefacts = [[] for _ in doc_info.capture_after_lines]
+    result.outputs = ["" for _ in doc_info.capture_after_lines]
+    if doc_info.skip or doc_info.output_style is Style.None_:
+        return result
+
+    code_cache = (_cache.CodeCache(context.cache_dir / "code")
+                  if context.cache_dir is not None else None)
+    code_key = (code_cache.get_key(doc_info, [context.tracing.value])
+                if code_cache else None)
+    with _timing.record_span(result.timings, "instrumented compile"):
+        code = code_cache.load(code_key) if code_cache else None
+        if code is None:
+            code = compile_exhibit(context, doc_info)
+            if code_cache:
+                code_cache.store(code_key, code)
+    src_path = doc_info.src_path
+
+    seen = set()
+    docref_cache = DocrefCache(context.docref_cache_size)
+
+    def record(offset, docref, obj, parent=None):
+        if docref:
+            # With Tracing.First, stop instrumenting the offset.
+            seen.add(offset)
+            (result.annotations
+             .setdefault(offset, Annotation(set(), None))
+             .docrefs.add(docref))
+            docref_cache.add(offset, obj, parent)
+
+    def sphinx_exhibit_name(obj, name, offset):
+        if not docref_cache.check(offset, obj):
+            record(offset, get_docref(obj, name), obj)
+        return obj
+
+    def sphinx_exhibit_attr(obj, name, offset):
+        attr = getattr(obj, name)
+        if not docref_cache.check(offset, attr, obj):
+            record(offset, get_docref(attr, name, parent=obj), attr, obj)
+        return attr
+
+    image_settings = doc_info.image_settings
+    # PNGs are encoded (and optimized) in the background, while the example
+    # keeps running; all writes are joined before returning.
+    image_pool = concurrent.futures.ThreadPoolExecutor()
+    image_futures = {}
+    image_cache_dir = (context.cache_dir / "images"
+                       if context.cache_dir is not None else None)
+
+    def save_figure(fig, dest, dpi):
+        pixels = (_images.render_rgba(fig, dpi) if dest.suffix == ".png"
+                  else None)
+        if pixels is not None:
+            image_futures[image_pool.submit(
+                _images.write_png, pixels, dest, dpi,
+                optimize=image_settings.optimize,
+                cache_dir=image_cache_dir)] = dest
+        else:
+            fig.savefig(str(dest), dpi=dpi)
+            if image_settings.optimize and dest.suffix == ".png":
+                image_futures[image_pool.submit(
+                    _images.optimize_png, dest, image_cache_dir)] = dest
+
+    block_idx = 0
+    sg_base_num = 0
+    def sphinx_exhibit_export():
+        with _timing.record_span(result.timings, "figure export"):
+            export_block()
+
+    def export_block():
+        nonlocal block_idx, sg_base_num
+        for fig_idx, fignum in enumerate(plt.get_fignums()):
+            if doc_info.output_style is Style.Native:
+                dest = Path(srcdir, "{}-{}-{}.{}".format(
+                    docname, block_idx, fig_idx, image_settings.format))
+            elif doc_info.output_style is Style.SG:
+                dir_path = Path(srcdir, docname).parent / "images"
+                dir_path.mkdir(exist_ok=True)
+                dest = Path(
+                    dir_path / "sphx_glr_{}_{:03}.{}".format(
+                        Path(docname).name, sg_base_num + fignum,
+                        image_settings.format))
+            else:
+                assert False
+            artefact = dest.relative_to(srcdir)
+            result.artefacts[block_idx].append(artefact)
+            fig = plt.figure(fignum)
+            dpi = image_settings.dpi or mpl.rcParams["savefig.dpi"]
+            if dpi == "figure":
+                dpi = fig.dpi
+            save_figure(fig, dest, dpi)
+            if (image_settings.srcset
+                    and image_settings.format not in _vector_formats):
+                variants = result.srcsets[artefact] = []
+                for density in image_settings.srcset:
+                    variant = dest.with_name("{}@{:g}x{}".format(
+                        dest.stem, density, dest.suffix))
+                    variants.append((density, variant.relative_to(srcdir)))
+                    save_figure(fig, variant, dpi * density)
+        if block_callback:
+            block_callback(
+                block_idx, stream.get_contents()[block_idx],
+                stream.flush_spill(block_idx),
+                result.artefacts[block_idx],
+                {artefact: result.srcsets[artefact]
+                 for artefact in result.artefacts[block_idx]
+                 if artefact in result.srcsets})
+        block_idx += 1
+        sg_base_num += len(plt.get_fignums())
+        # FIXME: Make this configurable?
+        plt.close("all")
+
+    head, tail = context.output_lines or (None, None)
+    spill_paths = [
+        get_spill_path(srcdir, docname, idx)
+        if context.output_lines and context.output_spill else None
+        for idx in range(len(result.outputs))]
+
+    class Stream:
+        def __init__(self):
+            self._spills = [
+                path.open("w", encoding="utf-8") if path else None
+                for path in spill_paths]
+            self._blocks = [_output.BoundedOutput(head, tail, spill)
+                            for spill in self._spills]
+
+        def write(self, s):
+            return self._blocks[block_idx].write(s)
+
+        def get_contents(self):
+            return [block.getvalue() for block in self._blocks]
+
+        def flush_spill(self, idx):
+            """Flush the spill file of a block, and return it if needed."""
+            block, spill, path = \
+                self._blocks[idx], self._spills[idx], spill_paths[idx]
+            if spill:
+                spill.flush()
+                if block.truncated:
+                    return path.relative_to(srcdir)
+            return None
 
-        return []
+        def close_spills(self):
+            """Close the spill files, and return those that are needed."""
+            paths = []
+            for block, spill, path in zip(
+                    self._blocks, self._spills, spill_paths):
+                if spill:
+                    spill.close()
+                    if block.truncated:
+                        paths.append(path.relative_to(srcdir))
+                        continue
+                    path.unlink()
+                paths.append(None)
+            return paths
+
+    stream = Stream()
+
+    # FIXME: chdir is only for s-g compatibility.
+    # FIXME: runpy + override source_to_code in a custom importer.
+    # Prevent Matplotlib's cleanup decorator from destroying the warnings
+    # filters.
+    # Record the project modules used by the example, both those that it
+    # imports directly (even if already loaded) and those that get loaded while
+    # it runs (which includes indirect imports).  The latter are then unloaded,
+    # so that the next example records them again.
+    def is_project_module(module):
+        path = getattr(module, "__file__", None)
+        return (bool(path)
+                and _cache.is_project_file(path, context.project_root))
+
+    imported_modules = []
+
+    def recording_import(
+            name, globals=None, locals=None, fromlist=(), level=0):
+        module = builtins.__import__(name, globals, locals, fromlist, level)
+        if level == 0:
+            imported_modules.append(sys.modules.get(name))
+            imported_modules.extend(
+                sys.modules.get(name + "." + attr) for attr in fromlist or ())
+        return module
+
+    modules_before = set(sys.modules)
+    profiler = cProfile.Profile() if context.profile_dir else None
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+
+    with image_pool, \
+         _patch_mpl_interactivity(), \
+         _util.chdir_cm(src_path.parent), \
+         _util.sys_argv_path_cm([str(src_path)]), \
+         warnings.catch_warnings(), \
+         contextlib.redirect_stdout(stream), \
+         contextlib.redirect_stderr(stream):
+        run = mpl.testing.decorators.cleanup("default")(lambda: exec(
+            code,
+            {_name_func_name: sphinx_exhibit_name,
+             _attr_func_name: sphinx_exhibit_attr,
+             _export_func_name: sphinx_exhibit_export,
+             _seen_name: seen,
+             "__builtins__": {**vars(builtins),
+                              "__import__": recording_import},
+             "__file__": str(src_path),
+             "__name__": "__main__"}))
+        try:
+            with _timing.record_span(result.timings, "execution"):
+                if profiler:
+                    profiler.runcall(run)
+                else:
+                    run()
+        except (Exception, SystemExit) as e:
+            _log.warning("%s raised %s: %s", docname, type(e).__name__, e)
+    # After the image writes are joined.
+    wall_time = time.perf_counter() - start_time
+    cpu_time = time.process_time() - start_cpu_time
+    if profiler:
+        profile_path = context.profile_dir / (docname + ".pstats")
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(profile_path))
+    for future, dest in image_futures.items():
+        if future.exception():
+            _log.warning("Failed to save %s: %s",
+                         dest.relative_to(srcdir), future.exception())
+
+    loaded_modules = {name: sys.modules[name]
+                      for name in set(sys.modules) - modules_before}
+    for name, module in loaded_modules.items():
+        if is_project_module(module):
+            del sys.modules[name]
+    result.imported_files = {
+        str(Path(module.__file__).resolve())
+        for module in [*imported_modules, *loaded_modules.values()]
+        if is_project_module(module)}
+    result.dependency_hashes = {
+        path: _cache.hash_file(path)
+        for path in [*result.imported_files,
+                     *[str(doc_info.src_path.parent / path)
+                       for path in doc_info.declared_files]]}
+    result.docref_cache_info = docref_cache.cache_info()
+    result.outputs = stream.get_contents()
+    result.output_files = stream.close_spills()
+    result.stats = ExecutionStats(
+        wall_time=wall_time,
+        cpu_time=cpu_time,
+        max_rss=_get_max_rss(),
+        figures=sum(map(len, result.artefacts)),
+        output_size=sum(map(len, result.outputs)))
+    return result
+
+
+def _get_max_rss():
+    try:
+        import resource
+    except ImportError:  # Windows.
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in kilobytes elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
 
 
 class ExhibitBlock(SourceGetterMixin):
@@ -575,6 +1584,14 @@ class ExhibitBlock(SourceGetterMixin):
                 "   " + line
                 for line in doc_info.outputs[block_idx].splitlines()
             ])
+        if doc_info.output_files and doc_info.output_files[block_idx]:
+            lines.extend([
+                "",
+                ":download:`Full output <{}>`".format(
+                    doc_info.output_files[block_idx].relative_to(
+                        current_source.parent)),
+                "",
+            ])
         for path in doc_info.artefacts[block_idx]:
             lines.extend([
                 ".. image:: {}".format(
@@ -593,63 +1610,54 @@ class ExhibitBlock(SourceGetterMixin):
         return node.children
 
 
-@functools.lru_cache()
-def resolve_docrefs(env):
+@_timing.timed_handler("docref resolution")
+def resolve_docrefs(app, env):
     """
-    Resolve the runtime annotations.
+    Resolve the runtime annotations, and update the backrefs accordingly.
 
     After this step, resolved annotations contain a single DocRef which
-    contains a single lookup.
+    contains a single lookup, and an href which is either a URI (for
+    intersphinx objects) or a builder-independent `LocalTarget` (as this runs
+    before the URIs of the docs are known for some builders).  This runs
+    before the env is pickled, so only the docs that were executed (or
+    restored from the execution cache) in this build need to be resolved,
+    unless the inventory changed.
     """
     env.exhibit_state = env.exhibit_state._replace(stage=Stage.ExecutionDone)
 
-    # Construct the merged inventory.
-    inv = {}
+    # Construct the merged inventory; the intersphinx inventories are only
+    # indexed as needed.
+    local_inv = {}
     py_domain = "py"
     # Adapted from InventoryFile.{dump,load_v2}.
     for name, dispname, role, docname, anchor, prio \
             in sorted(env.domains[py_domain].get_objects()):
-        uri = env.app.builder.get_target_uri(docname)
-        if anchor:
-            uri += "#" + anchor
-        inv.setdefault(py_domain + ":" + role, {})[name] = name, uri
-    if "sphinx.ext.intersphinx" in env.config.extensions:
-        for role, role_inv in env.intersphinx_inventory.items():
-            inv[role] = ChainMap(
-                inv.get(role, {}),
-                {name: (name, uri)
-                 for name, (project, version, uri, dispname)
-                 in role_inv.items()})
-    for role, role_inv in inv.items():
-        suffixes_role_inv = {}
-        for k, v in role_inv.items():
-            parts = k.split(".")
-            for i in range(len(parts)):
-                suffixes_role_inv.setdefault(".".join(parts[i:]), []).append(v)
-        inv[role] = ChainMap(
-            role_inv,
-            # Only keep unambiguous suffixes.
-            {suffix: _util.item(vs) for suffix, vs in suffixes_role_inv.items()
-             if len(vs) == 1})
+        local_inv.setdefault(py_domain + ":" + role, {})[name] = \
+            LocalTarget(docname, anchor)
+    intersphinx_inventory = (
+        env.intersphinx_inventory
+        if "sphinx.ext.intersphinx" in env.config.extensions else {})
+    inv = _inventory.Inventory(
+        local_inv, intersphinx_inventory,
+        Path(env.doctreedir, "exhibit-inventory-index"))
 
     def resolve_annotation(annotation):
         if len(annotation.docrefs) == 1:  # Otherwise, would be ambiguous.
             docref, = annotation.docrefs
 
             if docref.role == "any":
-                roles = inv
+                roles = inv.roles
             elif docref.role == "py:method":
                 roles = ["py:method", "py:classmethod", "py:staticmethod"]
             else:
                 roles = [docref.role]
 
             def lookup_by_role(role):
-                role_inv = inv.get(role, {})
                 for lookup in docref.lookups:
-                    try:
-                        true_lookup, uri = role_inv[lookup]
-                    except KeyError:
+                    found = inv.lookup(role, lookup)
+                    if not found:
                         continue
+                    true_lookup, uri = found
                     return annotation._replace(
                         docrefs={
                             docref._replace(
@@ -662,24 +1670,45 @@ def resolve_docrefs(env):
                 return _util.item(candidates)
         return annotation
 
-    # Resolve the docrefs.
-    for docname, doc_info in env.exhibit_state.docnames.items():
-        for offset, annotation in doc_info.annotations.items():
-            if len(annotation.docrefs) == 1:  # Other annots. are ambiguous.
-                docref, = annotation.docrefs
-                doc_info.annotations[offset] = resolve_annotation(annotation)
+    prev_docnames = env.exhibit_prev_state.docnames
+    docnames = env.exhibit_state.docnames
+    backrefs = env.exhibit_state.backrefs
+    inventory_key = inv.get_key()
+    if inventory_key != getattr(env, "exhibit_inventory_key", None):
+        env.exhibit_inventory_key = inventory_key
+        backrefs.clear()
+        for doc_info in docnames.values():
+            doc_info.resolved_annotations = None
+    else:
+        # Drop the contributions of removed docs and of docs to be resolved
+        # again.
+        for docname, prev_info in prev_docnames.items():
+            if (prev_info.resolved_annotations is not None
+                    and (docname not in docnames
+                         or docnames[docname].resolved_annotations is None)):
+                for key in _get_backref_keys(prev_info):
+                    backrefs[key].discard(docname)
+                    if not backrefs[key]:
+                        del backrefs[key]
+
+    for docname, doc_info in docnames.items():
+        if doc_info.resolved_annotations is not None:
+            continue
+        doc_info.resolved_annotations = {
+            offset: resolve_annotation(annotation)
+            for offset, annotation in doc_info.annotations.items()}
+        for key in _get_backref_keys(doc_info):
+            backrefs.setdefault(key, set()).add(docname)
 
 
-@functools.lru_cache()
-def compute_backrefs(env):
-    for docname, doc_info in env.exhibit_state.docnames.items():
-        for annotation in doc_info.annotations.values():
-            if annotation.href:  # Resolved, so single values below.
-                docref, = annotation.docrefs
-                lookup, = docref.lookups
-                (env.exhibit_state.backrefs
-                 .setdefault((docref.role, lookup), set())
-                 .add(docname))
+def _get_backref_keys(doc_info):
+    keys = set()
+    for annotation in doc_info.resolved_annotations.values():
+        if annotation.href:  # Resolved, so single values below.
+            docref, = annotation.docrefs
+            lookup, = docref.lookups
+            keys.add((docref.role, lookup))
+    return keys
 
 
 class exhibit_backrefs(rst.nodes.Element):
@@ -702,33 +1731,29 @@ class TransformExhibitBackrefs(SphinxTransform):
     default_priority = 400
 
     def apply(self):
-        resolve_docrefs(self.env)
-        compute_backrefs(self.env)
-
         class ExhibitBackrefsVisitor(rst.nodes.SparseNodeVisitor):
             def visit_exhibit_backrefs(_, node):
-                # FIXME: Directly build the docutils tree.  (Tried...)
                 backrefs = sorted(
                     self.env.exhibit_state.backrefs.get(
                         (node.attributes["role"], node.attributes["name"]),
                         []))
                 if backrefs:
-                    bullets = []
-                    titles = []
-                    hrefs = []
-                    for idx, docname in enumerate(backrefs):
-                        title = self.env.titles[docname][0].rawsource
-                        html_fname = ("../" * self.env.docname.count("/")
-                                    + docname + self.app.builder.out_suffix)
-                        bullets.append("- |id{}|__\n".format(idx))
-                        titles.append(".. |id{}| replace:: {}\n"
-                                      .format(idx, title))
-                        hrefs.append("__ {}\n".format(html_fname))
-                    new = docutils.core.publish_doctree(
-                        "".join(bullets) + "\n" +
-                        "".join(titles) + "\n" +
-                        "".join(hrefs))
-                    node.replace_self(new.children)
+                    items = []
+                    for docname in backrefs:
+                        title = [child.deepcopy() for child
+                                 in self.env.titles[docname].children]
+                        try:
+                            uri = self.app.builder.get_relative_uri(
+                                self.env.docname, docname)
+                        except NoUri:  # e.g., not in this LaTeX document.
+                            content = rst.nodes.inline("", "", *title)
+                        else:
+                            content = rst.nodes.reference(
+                                "", "", *title, refuri=uri)
+                        items.append(rst.nodes.list_item(
+                            "", rst.nodes.paragraph("", "", content)))
+                    node.replace_self(
+                        rst.nodes.bullet_list("", *items, bullet="-"))
                 else:
                     title_node_count = node.attributes["title_node_count"]
                     remove_from_idx = (
@@ -736,7 +1761,9 @@ class TransformExhibitBackrefs(SphinxTransform):
                     for idx in range(title_node_count + 1):
                         node.parent.pop(remove_from_idx)
 
-        self.document.walkabout(ExhibitBackrefsVisitor(self.document))
+        with self.app.exhibit_timings.span(
+                "backref transforms", self.env.docname):
+            self.document.walkabout(ExhibitBackrefsVisitor(self.document))
 
 
 def env_merge_info(app, env, docnames, other):
@@ -749,71 +1776,302 @@ def env_merge_info(app, env, docnames, other):
         info.merge(other_info)
 
 
+def html_page_context(app, pagename, templatename, context, doctree):
+    # Pages may be written by forked processes (with -j), so they are
+    # recorded in a file rather than in memory.
+    if pagename in app.env.exhibit_state.docnames:
+        with Path(app.doctreedir, _written_docs_name).open("a") as file:
+            file.write(pagename + "\n")
+
+
+def get_written_docs(app):
+    """Return (and forget) the exhibit pages written in this build."""
+    path = Path(app.doctreedir, _written_docs_name)
+    try:
+        written_docs = set(path.read_text().splitlines())
+    except FileNotFoundError:
+        return set()
+    path.unlink()
+    return written_docs
+
+
 def build_finished(app, exc):
-    if exc or app.builder.name != "html":  # s-g also whitelists "readthedocs"?
+    if exc:
+        return
+    written_docs = get_written_docs(app)
+    if app.config.exhibit_report:
+        _report.write_reports(
+            Path(app.outdir, "exhibit-report"),
+            [(docname, doc_info.stats)
+             for docname, doc_info in app.env.exhibit_state.docnames.items()
+             if doc_info.stats],
+            app.config.exhibit_report)
+    if app.builder.name != "html":  # s-g also whitelists "readthedocs"?
+        return
+    doc_infos = app.env.exhibit_state.docnames
+    generate_notebooks = (
+        app.tags.has("release")
+        if app.config.exhibit_generate_notebooks == "release-only" else
+        bool(app.config.exhibit_generate_notebooks))
+    # The keys of the inputs of each notebook, as of when it was written.
+    notebook_keys_path = Path(app.doctreedir, "exhibit-notebook-keys.pickle")
+    try:
+        with notebook_keys_path.open("rb") as file:
+            notebook_keys = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        notebook_keys = {}
+    # Unchanged pages keep their notebooks, if they are still generated.
+    new_notebook_keys = {
+        docname: key for docname, key in notebook_keys.items()
+        if docname in doc_infos and generate_notebooks}
+    tasks = {}
+    for docname, doc_info in doc_infos.items():
+        # Pages that were not rewritten have already been post-processed.
+        if docname not in written_docs:
+            continue
+        html_path = Path(app.builder.get_outfilename(docname))
+        # Sphinx only copies the artefacts themselves, under (possibly
+        # deduplicated) names listed in builder.images.
+        srcsets = {}
+        for artefact, variants in doc_info.srcsets.items():
+            name = app.builder.images.get(artefact.as_posix())
+            if name is None:
+                continue
+            srcsets[name] = []
+            for density, path in variants:
+                variant_name = "{}@{:g}x{}".format(
+                    Path(name).stem, density, Path(name).suffix)
+                _util.copy_if_changed(
+                    Path(app.srcdir, path),
+                    Path(app.outdir, app.builder.imagedir, variant_name))
+                srcsets[name].append((density, variant_name))
+        tasks[docname] = (
+            docname, html_path, doc_info.src_path, doc_info.code_line_ranges,
+            {offset: annotation._replace(
+                href=get_annotation_uri(app.builder, annotation.href))
+             for offset, annotation
+             in doc_info.resolved_annotations.items()},
+            srcsets,
+            "../" * (len(html_path.relative_to(app.outdir).parents) - 1),
+            generate_notebooks, notebook_keys.get(docname))
+    iter_docnames = functools.partial(
+        sphinx.util.status_iterator, length=len(tasks))
+    if app.parallel > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(app.parallel) as executor:
+            futures = {
+                executor.submit(
+                    _call_collecting_logs, postprocess_page, *task): docname
+                for docname, task in tasks.items()}
+            for future in iter_docnames(
+                    concurrent.futures.as_completed(futures),
+                    "post-processing exhibits... ",
+                    stringify_func=futures.__getitem__):
+                logs, (timings, notebook_key) = future.result()
+                for record in logs:
+                    _log.handle(record)
+                app.exhibit_timings.add_all(timings, futures[future])
+                new_notebook_keys[futures[future]] = notebook_key
+    else:
+        for docname in iter_docnames(tasks, "post-processing exhibits... "):
+            timings, notebook_key = postprocess_page(*tasks[docname])
+            app.exhibit_timings.add_all(timings, docname)
+            new_notebook_keys[docname] = notebook_key
+    new_notebook_keys = {
+        docname: key for docname, key in new_notebook_keys.items() if key}
+    # Delete the notebooks of removed examples, or of all examples if they
+    # are not generated anymore.
+    for docname in notebook_keys.keys() - new_notebook_keys.keys():
+        with contextlib.suppress(FileNotFoundError):
+            Path(app.builder.get_outfilename(docname)).with_suffix(
+                ".ipynb").unlink()
+    if new_notebook_keys != notebook_keys:
+        with notebook_keys_path.open("wb") as file:
+            pickle.dump(new_notebook_keys, file)
+
+
+def log_timings(app, exc):
+    if exc:
+        return
+    _log.verbose("exhibit stage timings:")
+    for line in app.exhibit_timings.format_summary():
+        _log.verbose("    %s", line)
+
+
+def get_annotation_uri(builder, href):
+    """Return the URI (relative to the root) of an annotation's href."""
+    if not isinstance(href, LocalTarget):
+        return href
+    try:
+        uri = builder.get_target_uri(href.docname)
+    except NoUri:
+        return None
+    return uri + "#" + href.anchor if href.anchor else uri
+
+
+def postprocess_page(
+        docname, html_path, src_path, code_line_ranges, annotations, srcsets,
+        rel_prefix, generate_notebooks, prev_notebook_key):
+    """
+    Copy the source of an exhibit page, and post-process its HTML.
+
+    The HTML is parsed only once; the annotations are embedded first, then the
+    notebook is generated from the same tree, unless its inputs are unchanged
+    since it was written with *prev_notebook_key*.  If *generate_notebooks* is
+    false, the link to the notebook is removed instead.  Pages that were
+    already post-processed are left as is.  This does not need the
+    application object, and can thus run in a worker process.  Return the time
+    spent in each stage, and the key of the notebook.
+    """
+    timings = {}
+    _util.copy_if_changed(src_path, html_path.with_suffix(".py"))
+    html = html_path.read_bytes()
+    # Checked on the raw HTML, which is much cheaper than parsing it.
+    if '<meta name="{}"'.format(_postprocessed_meta_name).encode() in html:
+        return timings, prev_notebook_key
+    tree = lxml.html.parse(io.BytesIO(html))
+    with _timing.record_span(timings, "link embedding"):
+        embed_annotations(tree, docname, annotations, rel_prefix)
+    add_srcsets(tree, srcsets)
+    if not generate_notebooks:
+        remove_notebook_link(tree.getroot())
+    head = tree.getroot().find("head")
+    if head is not None:
+        head.append(head.makeelement(
+            "meta", {"name": _postprocessed_meta_name,
+                     "content": __version__}))
+    buf = io.BytesIO()
+    tree.write(buf)
+    notebook_key = None
+    if generate_notebooks:
+        with _timing.record_span(timings, "notebook generation"):
+            notebook_path = html_path.with_suffix(".ipynb")
+            notebook_key = get_notebook_key(
+                tree.getroot(), src_path, code_line_ranges)
+            if (notebook_key != prev_notebook_key
+                    or not notebook_path.exists()):
+                notebook = generate_notebook(
+                    tree.getroot(), src_path, code_line_ranges)
+                with notebook_path.open("w") as file:
+                    nbformat.write(notebook, file)
+    # Written last, as the marker implies that the notebook was written.
+    html_path.write_bytes(buf.getvalue())
+    return timings, notebook_key
+
+
+def add_srcsets(tree, srcsets):
+    """
+    Add the high-resolution variants of the images to their ``srcset``.
+
+    *srcsets* maps the names of the images in the image directory to lists of
+    ``(density, name)`` of their variants.
+    """
+    if not srcsets:
         return
-    docnames = app.env.exhibit_state.docnames
-    iter_docnames = functools.partial(sphinx.util.status_iterator, docnames,
-                                      length=len(docnames))
-    for docname in iter_docnames("copying exhibit sources and notebooks... "):
-        copy_py_source(app, docname)
-        generate_notebook(app, docname)
-    for docname in iter_docnames("embedding links... "):
-        embed_annotations(app, docname)
-
-
-def copy_py_source(app, docname):
-    shutil.copyfile(
-        str(app.env.exhibit_state.docnames[docname].src_path),
-        str(Path(app.builder.get_outfilename(docname)).with_suffix(".py")))
-
-
-def generate_notebook(app, docname):
-    doc_info = app.env.exhibit_state.docnames[docname]
-    source_lines = [
-        None, *doc_info.src_path.read_text().splitlines(keepends=True)]
+    for img in tree.iter("img"):
+        src = img.get("src")
+        head, sep, name = src.rpartition("/")
+        if name in srcsets:
+            img.set("srcset", ", ".join(
+                ["{} 1x".format(src)]
+                + ["{}{}{} {:g}x".format(head, sep, variant_name, density)
+                   for density, variant_name in srcsets[name]]))
+
+
+def _get_ancestors(elem, root):
+    """Return the ancestors of *elem*, below *root*, down to *elem* itself."""
+    ancestors = [elem]
+    for parent in elem.iterancestors():
+        if parent is root:
+            return ancestors[::-1]
+        ancestors.append(parent)
+    assert False
+
+
+def _copy_between(elem, lo, hi):
+    """
+    Copy the part of the tree at *elem* that is strictly between two elements.
+
+    *lo* and *hi* are the ancestor chains (below *elem*, see `_get_ancestors`)
+    of the delimiting elements, or None if the part extends to the start
+    (respectively, the end) of *elem*.  The ancestors of the delimiters are
+    copied shallowly (keeping their text and tail), and the elements between
+    them deeply, so that each element in the tree is copied at most once when
+    splitting it at successive delimiters.  Siblings are walked with
+    ``getnext``, as indexing lxml elements is linear in the index.
+    """
+    copied = elem.makeelement(elem.tag, elem.attrib)
+    copied.text = elem.text
+    copied.tail = elem.tail
+    stop = hi[0] if hi else None
+    if lo:
+        if len(lo) > 1:
+            copied.append(_copy_between(
+                lo[0], lo[1:], hi[1:] if hi and hi[0] is lo[0] else None))
+        child = lo[0].getnext() if stop is not lo[0] else None
+    else:
+        child = elem[0] if len(elem) else None
+    while child is not None and child is not stop:
+        copied.append(copy.deepcopy(child))
+        child = child.getnext()
+    if hi and len(hi) > 1 and not (lo and lo[0] is hi[0]):
+        copied.append(_copy_between(hi[0], None, hi[1:]))
+    return copied
+
+
+def get_notebook_key(root, src_path, code_line_ranges):
+    """
+    Return a hash of the inputs of `generate_notebook`.
+
+    Only the smallest subtree spanning the blocks is hashed, so that changes
+    elsewhere in the page (e.g., in the navigation sidebars) do not cause the
+    notebook to be regenerated.
+    """
+    start, = root.findall(".//div[@class='sphinx-exhibit-blocks-start']")
+    seps = root.findall(".//div[@class='sphinx-exhibit-block-sep']")
+    chains = [_get_ancestors(elem, root) for elem in [start, *seps[-1:]]]
+    subtree = root
+    for elems in zip(*chains):
+        if elems[0] is not elems[-1]:
+            break
+        subtree = elems[0]
+    return _cache.hash_bytes(b"\0".join([
+        "{}:{}:{}".format(
+            __version__, nbformat.__version__, repr(code_line_ranges))
+        .encode("utf-8"),
+        src_path.read_bytes(),
+        lxml.etree.tostring(subtree),
+    ]))
+
+
+def remove_notebook_link(root):
+    for elem in root.findall(".//a[@download]"):
+        if elem.get("href", "").endswith(".ipynb"):
+            paragraph = elem.getparent()
+            paragraph.getparent().remove(paragraph)
+
+
+def generate_notebook(root, src_path, code_line_ranges):
+    """Generate a notebook from the (modified) tree of an exhibit page."""
+    source_lines = [None, *src_path.read_text().splitlines(keepends=True)]
     code_blocks = ("".join(source_lines[idx] for idx in code_block)
-                   for code_block in doc_info.code_line_ranges)
+                   for code_block in code_line_ranges)
     cells = []
 
-    html_path = Path(app.builder.get_outfilename(docname))
-    root = lxml.html.parse(str(html_path)).getroot()
     for elem in root.findall(".//a[@class='headerlink']"):
         elem.getparent().remove(elem)
     for elem in root.findall(".//div[@class='sphinx-exhibit-nbskip']"):
         elem.getparent().remove(elem)
 
-    elem, = root.findall(".//div[@class='sphinx-exhibit-blocks-start']")
-    assert elem.tail is None
-    parent = elem.getparent()
-    parent[:parent.index(elem) + 1] = []
-    elem = parent
-    while True:
-        parent = elem.getparent()
-        if parent is None:
-            break
-        parent[:parent.index(elem)] = []
-        elem = parent
-
-    while True:
-        elem = root.find(".//div[@class='sphinx-exhibit-block-sep']")
-        if elem is None:
-            break
-        assert elem.tail is None
-        etype = elem.attrib["type"]
-        remainder = copy.deepcopy(root)
-        # In the block, delete everything from the sep.
-        parent = elem.getparent()
-        parent[parent.index(elem):] = []
-        elem = parent
-        while True:
-            parent = elem.getparent()
-            if parent is None:
-                break
-            parent[parent.index(elem) + 1:] = []
-            elem = parent
+    start, = root.findall(".//div[@class='sphinx-exhibit-blocks-start']")
+    assert start.tail is None
+    seps = root.findall(".//div[@class='sphinx-exhibit-block-sep']")
+    chains = [_get_ancestors(elem, root) for elem in [start, *seps]]
+    for sep, prev_chain, chain in zip(seps, chains, chains[1:]):
+        assert sep.tail is None
+        etype = sep.attrib["type"]
         if etype == "text":
-            rendered = lxml.etree.tostring(root).decode("utf-8")
+            rendered = lxml.etree.tostring(
+                _copy_between(root, prev_chain, chain)).decode("utf-8")
             # Remove blank lines, as they are insignificant and cause md to
             # treat following indented lines as blocks.
             rendered = "\n".join(
@@ -826,36 +2084,16 @@ def generate_notebook(app, docname):
                 next(code_blocks).rstrip("\n")))
         else:
             assert False
-        # In the remainder tree, delete everything up to and including the sep.
-        root = remainder
-        # The same elem as above, but in the remainder tree.
-        elem = root.find(".//div[@class='sphinx-exhibit-block-sep']")
-        parent = elem.getparent()
-        parent[:parent.index(elem) + 1] = []
-        elem = parent
-        while True:
-            parent = elem.getparent()
-            if parent is None:
-                break
-            parent[:parent.index(elem)] = []
-            elem = parent
 
-    notebook = nbformat.v4.new_notebook(cells=cells)
-    with html_path.with_suffix(".ipynb").open("w") as file:
-        nbformat.write(notebook, file)
+    return nbformat.v4.new_notebook(cells=cells)
 
 
-def embed_annotations(app, docname):
-    html_path = Path(app.builder.get_outfilename(docname))
-    annotations = app.env.exhibit_state.docnames[docname].annotations
-
-    rel_prefix = "../" * (len(html_path.relative_to(app.outdir).parents) - 1)
+def embed_annotations(tree, docname, annotations, rel_prefix):
     def fix_rel_href(href):
         if "://" not in href:
             href = rel_prefix + href
         return href
 
-    tree = lxml.html.parse(str(html_path))
     elems = tree.findall(
         ".//div[@class='highlight-python3 notranslate']/div/pre")
     offset = 0
@@ -903,17 +2141,40 @@ def embed_annotations(app, docname):
         elem.text = ""
         elem.append(link)
 
-    tree.write(str(html_path))
-
 
 def setup(app):
     # These affect rst generation but don't invalidate previous parses.
     app.add_config_value("exhibit_syntax_style", "native", "")
     app.add_config_value("exhibit_output_style", "native", "")
+    app.add_config_value("exhibit_layout", "toctree", "")
+    app.add_config_value("exhibit_image_format", "png", "")
+    app.add_config_value("exhibit_image_dpi", None, "")
+    app.add_config_value("exhibit_image_srcset", [], "")
+    app.add_config_value("exhibit_image_optimize", False, "")
+    app.add_config_value("exhibit_thumbnail_scale", .25, "")
+    app.add_config_value("exhibit_jobs", 1, "")
+    app.add_config_value("exhibit_tracing", "all", "")
+    app.add_config_value("exhibit_docref_cache_size", 4096, "")
+    app.add_config_value("exhibit_cache_dir", None, "")
+    app.add_config_value("exhibit_project_root", None, "")
+    app.add_config_value("exhibit_report", [], "")
+    app.add_config_value("exhibit_profile_dir", None, "")
+    app.add_config_value("exhibit_output_lines", None, "")
+    app.add_config_value("exhibit_output_spill", False, "")
+    app.add_config_value("exhibit_preload_modules", [], "")
+    app.add_config_value("exhibit_timeout", None, "")
+    app.add_config_value("exhibit_memory_limit", None, "")
+    app.add_config_value(
+        "exhibit_generate_notebooks", True, "html", types=[bool, str])
+    app.add_event("exhibit-stage-timed")
     app.connect("builder-inited", builder_inited)
+    app.connect("env-get-outdated", env_get_outdated)
     app.connect("env-before-read-docs", env_before_read_docs)
     app.connect("env-merge-info", env_merge_info)
+    app.connect("env-updated", resolve_docrefs)
+    app.connect("html-page-context", html_page_context)
     app.connect("build-finished", build_finished)
+    app.connect("build-finished", log_timings)
     return {"version": __version__,
             "env_version": (os.environ.get("SPHINX_EXHIBIT_ENV_VERSION")
                             or __version__),
@@ -0,0 +1,163 @@
+"""
+Lookups of dotted names in the Sphinx inventories, either exactly or by
+unambiguous suffix (e.g. ``norm`` for ``numpy.linalg.norm``).
+
+Expanding each name of large inventories into all of its suffixes is slow and
+memory hungry, so the intersphinx names of each role are instead indexed once
+(per contents of the inventory) into a `SuffixIndex`, which is cached on disk
+and only loaded when a lookup is first needed.
+"""
+
+from array import array
+import bisect
+import hashlib
+import itertools
+from pathlib import Path
+import pickle
+
+from . import _util
+
+
+def _reverse(name):
+    return ".".join(reversed(name.split("."))) + "."
+
+
+def _unreverse(key):
+    return ".".join(reversed(key[:-1].split(".")))
+
+
+class SuffixIndex:
+    """
+    A compact index of dotted names, for lookups by suffix.
+
+    The names are stored with their components reversed and a trailing dot
+    (``c.b.a.`` for ``a.b.c``), sorted, and concatenated into a single string,
+    so that the names ending with a given suffix form a contiguous range,
+    found by bisection.
+    """
+
+    def __init__(self, names):
+        keys = sorted(map(_reverse, names))
+        self._keys = "".join(keys)
+        self._offsets = array(
+            "Q", itertools.accumulate(map(len, keys), initial=0))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        return self._keys[self._offsets[idx]:self._offsets[idx + 1]]
+
+    def iter_matches(self, suffix):
+        """Yield the names ending with *suffix* (at a component boundary)."""
+        key = _reverse(suffix)
+        lo = bisect.bisect_left(self, key)
+        # "/" is the character following ".".
+        hi = bisect.bisect_left(self, key[:-1] + "/", lo)
+        for idx in range(lo, hi):
+            yield _unreverse(self[idx])
+
+
+def _hash_role_inv(role, role_inv):
+    """Hash the names and URIs of an intersphinx inventory of a role."""
+    hasher = hashlib.sha256(role.encode("utf-8"))
+    for name, (project, version, uri, dispname) in role_inv.items():
+        hasher.update("\0{}\0{}".format(name, uri).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class Inventory:
+    """
+    The merged inventory of the local objects and the intersphinx inventories.
+
+    *local_inv* maps roles to dicts mapping names to targets;
+    *intersphinx_inventory* is the corresponding attribute of the env (or an
+    empty dict, if intersphinx is not in use), whose targets are URIs.  Local
+    objects take precedence over intersphinx ones.
+    """
+
+    def __init__(self, local_inv, intersphinx_inventory, cache_dir):
+        self._local_inv = local_inv
+        self._intersphinx_inventory = intersphinx_inventory
+        self._cache_dir = Path(cache_dir)
+        self._local_indices = {}
+        self._intersphinx_indices = {}
+        self._intersphinx_hashes = {}
+        self.roles = [*local_inv, *(role for role in intersphinx_inventory
+                                    if role not in local_inv)]
+
+    def _get_exact(self, role, name):
+        try:
+            return name, self._local_inv[role][name]
+        except KeyError:
+            pass
+        try:
+            project, version, uri, dispname = \
+                self._intersphinx_inventory[role][name]
+        except KeyError:
+            return None
+        return name, uri
+
+    def _get_intersphinx_hash(self, role):
+        if role not in self._intersphinx_hashes:
+            self._intersphinx_hashes[role] = _hash_role_inv(
+                role, self._intersphinx_inventory[role])
+        return self._intersphinx_hashes[role]
+
+    def get_key(self):
+        """Return a hash of the whole inventory."""
+        hasher = hashlib.sha256(repr(sorted(
+            (role, sorted(role_inv.items()))
+            for role, role_inv in self._local_inv.items())).encode("utf-8"))
+        for role in sorted(self._intersphinx_inventory):
+            hasher.update(self._get_intersphinx_hash(role).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _get_intersphinx_index(self, role):
+        try:
+            return self._intersphinx_indices[role]
+        except KeyError:
+            pass
+        key = self._get_intersphinx_hash(role)
+        path = self._cache_dir / (key + ".pickle")
+        try:
+            with path.open("rb") as file:
+                index = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            index = SuffixIndex(self._intersphinx_inventory[role])
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            with _util.atomic_write_cm(path) as tmp_path, \
+                 tmp_path.open("wb") as file:
+                pickle.dump(index, file, pickle.HIGHEST_PROTOCOL)
+        self._intersphinx_indices[role] = index
+        return index
+
+    def _iter_indices(self, role):
+        if role in self._local_inv:
+            if role not in self._local_indices:
+                self._local_indices[role] = SuffixIndex(self._local_inv[role])
+            yield self._local_indices[role]
+        if role in self._intersphinx_inventory:
+            yield self._get_intersphinx_index(role)
+
+    def lookup(self, role, name):
+        """
+        Return the ``(full_name, uri)`` that *name* refers to, or None.
+
+        *name* can be either a full name, or a suffix matching a single full
+        name.
+        """
+        exact = self._get_exact(role, name)
+        if exact:
+            return exact
+        full_names = set()
+        for index in self._iter_indices(role):
+            for full_name in index.iter_matches(name):
+                full_names.add(full_name)
+                # Ambiguous (the same name may be in multiple inventories).
+                if len(full_names) > 1:
+                    return None
+        if full_names:
+            full_name, = full_names
+            return self._get_exact(role, full_name)
+        return None
@@ -1,77 +1,51 @@
 import ast
-import bisect
+import io
 import itertools
 import tokenize
 
 
-def iter_attribute_tokens(fname):
-    with open(fname, "rb") as file:
-        # The call to filter handles cases where an attribute access dot is at
-        # the end of a line and the attribute itself on the next one.
-        tokens = filter(lambda token: token.string != "\n",
-                        tokenize.tokenize(file.readline))
-        for token in tokens:
-            if token.string == ".":
-                yield next(tokens)  # Also catches submodule imports :/
-
-
 def parse(fname, code_line_idxs):
-    attr_tokens = iter_attribute_tokens(fname)
-
-    with tokenize.open(fname) as file:
-        source = file.read()
+    """
+    Parse *fname*, setting the ``offset`` attribute of Name and Attribute
+    nodes.
+
+    The offsets are in characters, in the source where the lines not listed in
+    *code_line_idxs* (1-based) are removed (i.e., in the concatenation of the
+    code blocks).  For attributes, the offset is the one of the attribute name
+    (after the dot).
+    """
+    with open(fname, "rb") as file:
+        data = file.read()
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    # Universal newlines, as tokenize.open.
+    source = io.TextIOWrapper(io.BytesIO(data), encoding).read()
 
     lines = source.splitlines(keepends=True)
-    skipped_line_idxs = {*range(1, len(lines) + 1)}.difference(code_line_idxs)
-    for idx in skipped_line_idxs:
-        lines[idx - 1] = ""
-    line_start_offsets = [
-        0, *itertools.accumulate(len(line) for line in lines)]
+    line_lengths = [0] * len(lines)
+    for idx in code_line_idxs:
+        if idx <= len(lines):
+            line_lengths[idx - 1] = len(lines[idx - 1])
+    line_start_offsets = [0, *itertools.accumulate(line_lengths)]
 
     def to_offset(lineno, col_offset):
+        # The AST's col_offsets are in bytes of UTF-8.
+        line = lines[lineno - 1]
+        if not line.isascii():
+            col_offset = len(
+                line.encode("utf-8")[:col_offset].decode("utf-8"))
         return line_start_offsets[lineno - 1] + col_offset
 
-    class OffsetAnnotator(ast.NodeVisitor):
-        def visit_Name(self, node):
-            self.generic_visit(node)
+    mod = ast.parse(source)
+    for node in ast.walk(mod):
+        if isinstance(node, ast.Name):
             # NOTE: For decorators, this will miss the "@" just before.  This
             # is taken into account at the annotation embedding stage.
             # NOTE: Something funky is going on with whether @foo.bar is
             # highlighted fully as a decorator or only partially...
             node.offset = to_offset(node.lineno, node.col_offset)
-
-        def visit_Attribute(self, node):
-            self.generic_visit(node)
-            while True:
-                # Skip spurious ".foo" coming from submodule imports.
-                token = next(attr_tokens)
-                if node.attr == token.string:
-                    break
-            node.offset = to_offset(*token.start)
-
-        # These are only necessary to handle fields in the order in which they
-        # appear in the source, rather than the order they appear in the node.
-        def visit_FunctionDef(self, node):
-            for expr in node.decorator_list:
-                self.visit(expr)
-            self.visit(node.args)
-            if node.returns:
-                self.visit(node.returns)
-            for stmt in node.body:
-                self.visit(stmt)
-
-        visit_AsyncFunctionDef = visit_FunctionDef
-
-        def visit_ClassDef(self, node):
-            for expr in node.decorator_list:
-                self.visit(expr)
-            for expr in node.bases:
-                self.visit(expr)
-            for keyword in node.keywords:
-                self.visit(keyword)
-            for stmt in node.body:
-                self.visit(stmt)
-
-    mod = ast.parse(source)
-    OffsetAnnotator().visit(mod)
+        elif isinstance(node, ast.Attribute):
+            # The attribute name ends the node.  NOTE: This is off for names
+            # that are changed by NFKC normalization.
+            node.offset = (to_offset(node.end_lineno, node.end_col_offset)
+                           - len(node.attr))
     return mod
@@ -0,0 +1,99 @@
+"""
+Bounded capture of the output of the examples.
+"""
+
+import collections
+
+
+# Longest line kept by bounded captures; the rest of the line is elided.
+MAX_LINE_LENGTH = 10000
+
+
+class BoundedOutput:
+    """
+    A text stream keeping at most the first *head* and the last *tail* lines
+    written to it (or everything, unchanged, if *head* and *tail* are None),
+    so that its memory use is bounded.
+
+    When bounded, a carriage return not followed by a newline erases the
+    current line, as on a terminal, so that progress bars only leave their
+    final state.  If *spill* is given, the full output is additionally written
+    to it.
+    """
+
+    def __init__(self, head=None, tail=None, spill=None):
+        self._bounded = head is not None and tail is not None
+        self._chunks = []  # Everything written, if not bounded.
+        self._head_size = head
+        self._head = []
+        self._tail = collections.deque(maxlen=tail)
+        self._n_elided = 0
+        self._truncated = False
+        self._current = ""
+        self._current_elided = 0  # Characters elided from the current line.
+        self._spill = spill
+
+    def write(self, s):
+        if self._spill:
+            self._spill.write(s)
+        if not self._bounded:
+            self._chunks.append(s)
+            return len(s)
+        *lines, rest = s.split("\n")
+        for line in lines:
+            self._append(line)
+            self._add_line(self._pop_current())
+        self._append(rest)
+        return len(s)
+
+    def _append(self, s):
+        text = self._current + s
+        # A trailing carriage return only erases the line if text follows.
+        idx = text.rfind("\r", 0, len(text) - 1)
+        if idx != -1:
+            text = text[idx + 1:]
+            self._current_elided = 0
+        if len(text) > MAX_LINE_LENGTH:
+            self._current_elided += len(text) - MAX_LINE_LENGTH
+            self._truncated = True
+            text = text[:MAX_LINE_LENGTH]
+        self._current = text
+
+    def _format_current(self):
+        line = self._current
+        if line.endswith("\r"):
+            line = line[:-1]
+        if self._current_elided:
+            line += " ... {} characters elided ...".format(
+                self._current_elided)
+        return line
+
+    def _pop_current(self):
+        line = self._format_current()
+        self._current = ""
+        self._current_elided = 0
+        return line
+
+    def _add_line(self, line):
+        if len(self._head) < self._head_size:
+            self._head.append(line)
+        else:
+            if len(self._tail) == self._tail.maxlen:
+                self._n_elided += 1
+                self._truncated = True
+            self._tail.append(line)
+
+    @property
+    def truncated(self):
+        """Whether any line or part of a line was elided."""
+        return self._truncated
+
+    def getvalue(self):
+        if not self._bounded:
+            return "".join(self._chunks)
+        lines = [*self._head]
+        if self._n_elided:
+            lines.append("... {} lines elided ...".format(self._n_elided))
+        lines.extend(self._tail)
+        lines.append(self._format_current())
+        return "\n".join(lines)
@@ -0,0 +1,91 @@
+"""
+Reports of the resource usage of the examples, to find the slow ones.
+"""
+
+import csv
+import html
+import json
+
+
+_html_template = """\
+<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Sphinx-Exhibit execution report</title>
+<style>
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: .2em .5em; }}
+th {{ cursor: pointer; }}
+td.num {{ text-align: right; }}
+</style>
+</head>
+<body>
+<p>Click on a column header to sort by it.</p>
+<table>
+<thead><tr>{header}</tr></thead>
+<tbody>
+{rows}
+</tbody>
+</table>
+<script>
+document.querySelectorAll("th").forEach(function (th, idx) {{
+  th.addEventListener("click", function () {{
+    var tbody = document.querySelector("tbody");
+    var rows = Array.from(tbody.rows);
+    var asc = th.dataset.order !== "asc";
+    th.dataset.order = asc ? "asc" : "desc";
+    rows.sort(function (a, b) {{
+      var x = a.cells[idx].dataset.value, y = b.cells[idx].dataset.value;
+      var cmp = (isNaN(x) || isNaN(y)) ? x.localeCompare(y) : x - y;
+      return asc ? cmp : -cmp;
+    }});
+    rows.forEach(function (row) {{ tbody.appendChild(row); }});
+  }});
+}});
+</script>
+</body>
+</html>
+"""
+
+
+def write_reports(path, entries, formats):
+    """
+    Write the report on *entries* (``(docname, stats)`` pairs) to *path*, with
+    the suffix of each of the *formats* ("json", "csv", or "html").
+    """
+    entries = sorted(entries, key=lambda entry: -entry[1].wall_time)
+    fields = ["docname", *entries[0][1]._fields] if entries else ["docname"]
+    rows = [[docname, *stats] for docname, stats in entries]
+    for fmt in formats:
+        dest = path.with_suffix("." + fmt)
+        if fmt == "json":
+            dest.write_text(json.dumps(
+                [dict(zip(fields, row)) for row in rows], indent=2))
+        elif fmt == "csv":
+            with dest.open("w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(fields)
+                writer.writerows(rows)
+        elif fmt == "html":
+            dest.write_text(_html_template.format(
+                header="".join(
+                    "<th>{}</th>".format(html.escape(field))
+                    for field in fields),
+                rows="\n".join(
+                    "<tr>{}</tr>".format("".join(
+                        _format_html_cell(value) for value in row))
+                    for row in rows)))
+        else:
+            raise ValueError("Unknown report format: {!r}".format(fmt))
+
+
+def _format_html_cell(value):
+    if isinstance(value, str):
+        return '<td data-value="{0}">{0}</td>'.format(html.escape(value))
+    elif value is None:
+        return '<td data-value="">-</td>'
+    elif isinstance(value, float):
+        return '<td class="num" data-value="{0!r}">{0:.3f}</td>'.format(value)
+    else:
+        return '<td class="num" data-value="{0}">{0}</td>'.format(value)
@@ -0,0 +1,69 @@
+"""
+Timing of the stages of the exhibit pipeline.
+
+Spans may nest (e.g., the figures are exported while the examples run), so
+the totals of the stages do not add up to the build time.  Stages that may
+run in worker processes record their spans into plain dicts, which are
+reported by the main process.
+"""
+
+import contextlib
+import functools
+import time
+
+
+@contextlib.contextmanager
+def record_span(timings, stage):
+    """Add the time spent in the block to ``timings[stage]``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+
+class Timings:
+    """
+    Totals of the spans of each stage, each of which is also reported through
+    the ``exhibit-stage-timed`` event.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._totals = {}  # Maps stages to (total time, number of spans).
+
+    def add(self, stage, seconds, docname=None):
+        total, count = self._totals.get(stage, (0, 0))
+        self._totals[stage] = total + seconds, count + 1
+        self._app.emit("exhibit-stage-timed", stage, seconds, docname)
+
+    def add_all(self, timings, docname=None):
+        for stage, seconds in timings.items():
+            self.add(stage, seconds, docname)
+
+    @contextlib.contextmanager
+    def span(self, stage, docname=None):
+        timings = {}
+        try:
+            with record_span(timings, stage):
+                yield
+        finally:
+            self.add_all(timings, docname)
+
+    def format_summary(self):
+        """Return the lines of a summary table, in order of first span."""
+        width = max(map(len, self._totals), default=0)
+        return ["{:<{}}  {:9.3f}s  ({} span{})".format(
+                    stage, width, total, count, "s" if count > 1 else "")
+                for stage, (total, count) in self._totals.items()]
+
+
+def timed_handler(stage):
+    """Decorate an event handler (taking the app first) to time it."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(app, *args, **kwargs):
+            with app.exhibit_timings.span(stage):
+                return func(app, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -3,7 +3,9 @@ import functools
 import inspect
 from inspect import Parameter
 import os
+import shutil
 import sys
+import threading
 
 from docutils.parsers import rst
 
@@ -23,6 +25,65 @@ def chdir_cm(path):
         os.chdir(pwd)
 
 
+@contextlib.contextmanager
+def sys_argv_path_cm(argv):
+    # Also restore sys.path, which examples may modify, as processes run
+    # multiple examples.
+    saved_argv = sys.argv
+    saved_path = sys.path[:]
+    sys.argv = argv
+    try:
+        yield
+    finally:
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+
+
+def write_if_changed(path, text):
+    # Avoid bumping the mtime, which Sphinx uses to find outdated docs.
+    try:
+        if path.read_text() == text:
+            return
+    except FileNotFoundError:
+        pass
+    path.write_text(text)
+
+
+@contextlib.contextmanager
+def atomic_write_cm(path):
+    """
+    Yield a temporary path, which is renamed to *path* once written.
+
+    Concurrent builds (and processes reading *path* after its writer was
+    killed) thus never see partial files.  The suffix of *path* is kept, as
+    some writers (e.g. Matplotlib) infer the format from it.
+    """
+    tmp_path = path.with_name("{}.{}-{}.tmp{}".format(
+        path.stem, os.getpid(), threading.get_ident(), path.suffix))
+    try:
+        yield tmp_path
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            tmp_path.unlink()
+        raise
+    os.replace(str(tmp_path), str(path))
+
+
+def copy_if_changed(src, dst):
+    # copy2 preserves the mtime, so that unchanged copies can be detected by
+    # stat'ing.
+    src_stat = src.stat()
+    try:
+        dst_stat = dst.stat()
+    except FileNotFoundError:
+        pass
+    else:
+        if (dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+                and dst_stat.st_size == src_stat.st_size):
+            return
+    shutil.copy2(str(src), str(dst))
+
+
 def directive_runner(
         func=None, *, final_argument_whitespace=False, has_content=False):
     if func is None:
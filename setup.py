@@ -15,7 +15,7 @@ setup(
     packages=find_namespace_packages("lib"),
     package_dir={"": "lib"},
     ext_modules=[],
-    package_data={},
+    package_data={"sphinx_exhibit": ["_static/*"]},
     python_requires=">=3.8",
     setup_requires=["setuptools_scm"],
     use_scm_version=lambda: {  # xref __init__.py
@@ -26,7 +26,7 @@ setup(
         "lxml",  # Bounded by Py3.8 support.
         "matplotlib>=2.0",  # Changed mpl.testing.decorators.cleanup.
         "nbformat>=4.0",
-        "sphinx>=1.7",  # BuildEnvironment.prepare_settings.
+        "sphinx>=1.8",  # app.add_css_file.
         # Depends on nose on "old-enough" matplotlibs.
     ],
     entry_points={
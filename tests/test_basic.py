@@ -4,13 +4,17 @@ import subprocess
 import sys
 from pathlib import Path
 
+import pytest
 
-def test_run():
+
+@pytest.mark.parametrize("extra_args", [[], ["-Dexhibit_jobs=2", "-j2"]])
+def test_run(extra_args):
     for to_clean in ["source/examples", "build"]:
         with contextlib.suppress(FileNotFoundError):
             shutil.rmtree(
                 str(Path(__file__).parent / "sphinx-tree" / to_clean))
     subprocess.run(
-        [sys.executable, "-msphinx", "-M", "html", "source", "build", "-T"],
+        [sys.executable, "-msphinx", "-M", "html", "source", "build", "-T",
+         *extra_args],
         cwd=str(Path(__file__).parent / "sphinx-tree"),
         check=True)
@@ -0,0 +1,40 @@
+import gc
+import weakref
+
+import numpy as np
+
+from sphinx_exhibit._implementation import DocrefCache
+
+
+class Foo:
+    def method(self):
+        pass
+
+
+class Bar:
+    def method(self):
+        pass
+
+
+def test_bound_methods():
+    cache = DocrefCache(16)
+    foo = Foo()
+    cache.add(0, foo.method, foo)
+    assert cache.check(0, Foo().method, Foo())
+    assert not cache.check(0, Bar().method, Bar())
+    arr = np.ones(3)
+    cache.add(1, arr.sum, arr)
+    assert cache.check(1, np.zeros(2).sum, np.zeros(2))
+    assert not cache.check(1, [].copy, [])
+
+
+def test_instances_not_kept_alive():
+    cache = DocrefCache(16)
+    foo = Foo()
+    arr = np.ones(3)
+    refs = [weakref.ref(foo), weakref.ref(arr)]
+    cache.add(0, foo.method, foo)
+    cache.add(1, arr.sum, arr)
+    del foo, arr
+    gc.collect()
+    assert all(ref() is None for ref in refs)
@@ -0,0 +1,21 @@
+import numpy as np
+from PIL import Image
+
+from sphinx_exhibit._images import optimize_png
+
+
+def test_optimize_png(tmp_path):
+    pixels = np.zeros((64, 64, 4), np.uint8)
+    pixels[..., 3] = 255
+    pixels[16:48, 16:48] = [255, 0, 0, 128]
+    path = tmp_path / "image.png"
+    cache_dir = tmp_path / "cache"
+    for _ in range(2):  # Optimize, then restore from the cache.
+        Image.fromarray(pixels).save(str(path))
+        size = path.stat().st_size
+        optimize_png(path, cache_dir)
+        assert path.stat().st_size < size
+        with Image.open(str(path)) as image:
+            assert image.mode == "P"
+            assert (np.asarray(image.convert("RGBA")) == pixels).all()
+    assert len([*cache_dir.iterdir()]) == 1
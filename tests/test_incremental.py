@@ -0,0 +1,53 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+def build(path):
+    subprocess.run(
+        [sys.executable, "-msphinx", "-M", "html", "source", "build", "-T",
+         "-q"],
+        cwd=str(path), check=True)
+    return Path(path, "build/html/examples/example.html").read_text()
+
+
+def test_dependency_change(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "conf.py").write_text(
+        'extensions = ["sphinx_exhibit"]\n'
+        'exhibit_cache_dir = False\n')
+    (source / "index.rst").write_text(
+        "Index\n"
+        "=====\n"
+        "\n"
+        ".. exhibit::\n"
+        "   :srcdir: ../examples\n"
+        "   :destdir: examples\n"
+        "\n"
+        "   *.py\n")
+    examples = tmp_path / "examples"
+    examples.mkdir()
+    (examples / "example.py").write_text(
+        '"""\n'
+        "Example\n"
+        "=======\n"
+        "\n"
+        ".. exhibit-depends:: data.txt\n"
+        '"""\n'
+        "\n"
+        "import sys\n"
+        'sys.path.insert(0, "lib")\n'
+        "import helper\n"
+        'print("helper value", helper.VALUE)\n'
+        'print("data", open("data.txt").read())\n')
+    # Not in the examples' directory, so that it is not an example itself.
+    (examples / "lib").mkdir()
+    (examples / "lib/helper.py").write_text("VALUE = 1\n")
+    (examples / "data.txt").write_text("one")
+    html = build(tmp_path)
+    assert "helper value 1" in html and "data one" in html
+    (examples / "lib/helper.py").write_text("VALUE = 2\n")
+    (examples / "data.txt").write_text("two")
+    html = build(tmp_path)
+    assert "helper value 2" in html and "data two" in html
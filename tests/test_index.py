@@ -0,0 +1,33 @@
+from sphinx_exhibit._implementation import get_blocks_source, index_source
+
+
+RST = """\
+Title
+=====
+
+.. exhibit::
+   :srcdir: examples
+
+   *.py
+
+Usage::
+
+   .. exhibit::
+      :srcdir: other
+
+Text.
+"""
+
+
+def test_index_source(tmp_path):
+    path = tmp_path / "index.rst"
+    path.write_text(RST)
+    entry = index_source(path, path.stat())
+    assert not entry.generated
+    assert entry.blocks == [
+        (3, ".. exhibit::\n   :srcdir: examples\n\n   *.py\n\n"),
+        (8, "Usage::\n\n   .. exhibit::\n      :srcdir: other\n\n"),
+    ]
+    source = get_blocks_source(entry.blocks)
+    assert source.splitlines()[3] == ".. exhibit::"
+    assert source.splitlines()[8] == "Usage::"
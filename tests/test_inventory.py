@@ -0,0 +1,38 @@
+from sphinx_exhibit._inventory import Inventory, SuffixIndex
+
+
+def test_suffix_index():
+    index = SuffixIndex(["a.b.c", "x.b.c", "a.bc", "c", "a.b.cd"])
+    assert sorted(index.iter_matches("c")) == ["a.b.c", "c", "x.b.c"]
+    assert sorted(index.iter_matches("b.c")) == ["a.b.c", "x.b.c"]
+    assert [*index.iter_matches("bc")] == ["a.bc"]
+    assert [*index.iter_matches("d")] == []
+
+
+def test_inventory(tmp_path):
+    local_inv = {"py:function": {"pkg.func": "api.html#pkg.func"}}
+    invdata = {
+        "py:function": {
+            "numpy.linalg.norm": ("numpy", "1", "np.html#norm", "-"),
+            "scipy.linalg.norm": ("scipy", "1", "sp.html#norm", "-"),
+            "numpy.sum": ("numpy", "1", "np.html#sum", "-"),
+        },
+        "py:class": {"numpy.ndarray": ("numpy", "1", "np.html#nd", "-")},
+    }
+    for _ in range(2):  # Build, then reload the indices.
+        inv = Inventory(local_inv, invdata, tmp_path)
+        assert inv.roles == ["py:function", "py:class"]
+        assert inv.lookup("py:function", "func") == (
+            "pkg.func", "api.html#pkg.func")
+        assert inv.lookup("py:function", "sum") == (
+            "numpy.sum", "np.html#sum")
+        assert inv.lookup("py:function", "numpy.linalg.norm") == (
+            "numpy.linalg.norm", "np.html#norm")
+        assert inv.lookup("py:function", "linalg.norm") is None
+        assert inv.lookup("py:function", "ndarray") is None
+        assert inv.lookup("py:class", "ndarray") == (
+            "numpy.ndarray", "np.html#nd")
+    assert len([*tmp_path.iterdir()]) == 2  # One index per role.
+    key = inv.get_key()
+    invdata["py:class"]["numpy.ndarray"] = ("numpy", "2", "np2.html#nd", "-")
+    assert Inventory(local_inv, invdata, tmp_path).get_key() != key
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+from sphinx_exhibit._implementation import (
+    ExecutionContext, ImageSettings, Style, Tracing, doc_info_from_py_source,
+    execute_exhibit_supervised, parse_size)
+
+
+def test_parse_size():
+    assert parse_size("512") == 512
+    assert parse_size("2k") == 2048
+    assert parse_size("1.5 G") == 3 * 1024 ** 3 // 2
+
+
+def test_timeout(tmp_path):
+    src_path = tmp_path / "hang.py"
+    src_path.write_text(
+        'print("first")\n'
+        '\n'
+        '"""\n'
+        'Hang.\n'
+        '"""\n'
+        '\n'
+        'while True:\n'
+        '    pass\n')
+    doc_info = doc_info_from_py_source(
+        src_path, syntax_style=Style.Native, output_style=Style.Native)
+    doc_info.image_settings = ImageSettings("png", None, (), False)
+    context = ExecutionContext(
+        srcdir=tmp_path, project_root=tmp_path, tracing=Tracing.All,
+        docref_cache_size=0, cache_dir=None, profile_dir=None,
+        output_lines=None, output_spill=False)
+    logs, result = execute_exhibit_supervised(
+        context, "hang", doc_info, 1, None)
+    assert result.interrupted
+    assert result.outputs == ["first\n", ""]
+
+
+def test_timeout_output_files(tmp_path):
+    src_path = tmp_path / "hang.py"
+    src_path.write_text(
+        'for i in range(5):\n'
+        '    print(i)\n'
+        '\n'
+        '"""\n'
+        'Hang.\n'
+        '"""\n'
+        '\n'
+        'print("partial")\n'
+        'while True:\n'
+        '    pass\n')
+    doc_info = doc_info_from_py_source(
+        src_path, syntax_style=Style.Native, output_style=Style.Native)
+    doc_info.image_settings = ImageSettings("png", None, (), False)
+    context = ExecutionContext(
+        srcdir=tmp_path, project_root=tmp_path, tracing=Tracing.All,
+        docref_cache_size=0, cache_dir=None, profile_dir=None,
+        output_lines=(1, 1), output_spill=True)
+    logs, result = execute_exhibit_supervised(
+        context, "hang", doc_info, 1, None)
+    assert result.interrupted
+    assert result.output_files == [Path("hang-0-output.txt"), None]
+    assert (tmp_path / "hang-0-output.txt").read_text() == "0\n1\n2\n3\n4\n"
+    assert not (tmp_path / "hang-1-output.txt").exists()
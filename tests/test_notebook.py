@@ -0,0 +1,59 @@
+from pathlib import Path
+
+import lxml.html
+
+from sphinx_exhibit._implementation import generate_notebook
+
+
+# Mimics the HTML output by Sphinx for an exhibit with two text and two code
+# blocks, followed by some text at the end of the file.
+HTML = """\
+<html>
+<body>
+<div class="document">
+<p>Download this example.</p>
+<div class='sphinx-exhibit-blocks-start'/><div class="section" id="title">
+<h1>Title<a class="headerlink" href="#title">¶</a></h1>
+<p>Some <em>text</em>.</p>
+<div class='sphinx-exhibit-block-sep' type='text'/><div class="highlight-python3 notranslate"><div class="highlight"><pre><span/>x = 1
+</pre></div>
+</div>
+<div class='sphinx-exhibit-nbskip'><pre>output</pre>
+</div>
+<div class='sphinx-exhibit-block-sep' type='code'/><div class="section" id="sub">
+<h2>Sub<a class="headerlink" href="#sub">¶</a></h2>
+<div class='sphinx-exhibit-block-sep' type='text'/><div class="highlight-python3 notranslate"><div class="highlight"><pre><span/>print(x)
+</pre></div>
+</div>
+</div><div class='sphinx-exhibit-block-sep' type='code'/><p>The end.</p>
+<div class='sphinx-exhibit-block-sep' type='text'/><p>Epilog.</p>
+</div>
+</div>
+</body>
+</html>
+"""
+
+
+def test_generate_notebook(tmp_path):
+    src_path = Path(tmp_path, "example.py")
+    src_path.write_text('"""\nTitle\n"""\nx = 1\n"""Sub"""\nprint(x)\n')
+    notebook = generate_notebook(
+        lxml.html.document_fromstring(HTML), src_path,
+        [range(4, 5), range(6, 7)])
+    # Generated by the previous (quadratic) implementation.
+    assert [(cell.cell_type, cell.source) for cell in notebook.cells] == [
+        ("markdown",
+         '<html>\n<body>\n<div class="document">\n'
+         '<div class="section" id="title">\n<h1>Title</h1>\n'
+         '<p>Some <em>text</em>.</p>\n</div>\n</div>\n</body>\n</html>'),
+        ("code", "x = 1"),
+        ("markdown",
+         '<html>\n<body>\n<div class="document">\n'
+         '<div class="section" id="title">\n<div class="section" id="sub">\n'
+         '<h2>Sub</h2>\n</div></div>\n</div>\n</body>\n</html>'),
+        ("code", "print(x)"),
+        ("markdown",
+         '<html>\n<body>\n<div class="document">\n'
+         '<div class="section" id="title">\n<p>The end.</p>\n</div>\n</div>\n'
+         '</body>\n</html>'),
+    ]
@@ -0,0 +1,26 @@
+import ast
+
+from sphinx_exhibit._offset_annotator import parse
+
+
+def test_offsets(tmp_path):
+    source = """\
+# Not code.
+é = "ü"; x = é
+y = (x
+     .real
+     if x.imag else None)
+"""
+    path = tmp_path / "example.py"
+    path.write_text(source, encoding="utf-8")
+    mod = parse(path, [2, 3, 4, 5])
+    code = source.split("\n", 1)[1]
+    names = sorted(
+        (node.offset, node.attr if isinstance(node, ast.Attribute)
+         else node.id)
+        for node in ast.walk(mod)
+        if isinstance(node, (ast.Name, ast.Attribute)))
+    assert all(code[offset:offset + len(name)] == name
+               for offset, name in names)
+    assert [name for offset, name in names] == [
+        "é", "x", "é", "y", "x", "real", "x", "imag"]
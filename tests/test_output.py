@@ -0,0 +1,36 @@
+import io
+
+from sphinx_exhibit._output import MAX_LINE_LENGTH, BoundedOutput
+
+
+def test_unbounded():
+    output = BoundedOutput()
+    for s in ["a\nb", "c\n", "10%\r", "20%\r", "\n", "x\r\n", "y"]:
+        output.write(s)
+    assert output.getvalue() == "a\nbc\n10%\r20%\r\nx\r\ny"
+    assert not output.truncated
+
+
+def test_bounded():
+    spill = io.StringIO()
+    output = BoundedOutput(2, 1, spill)
+    for i in range(10):
+        output.write("{}\n".format(i))
+    assert output.getvalue() == "0\n1\n... 7 lines elided ...\n9\n"
+    assert output.truncated
+    assert spill.getvalue() == "".join(map("{}\n".format, range(10)))
+
+
+def test_carriage_return():
+    output = BoundedOutput(10, 10)
+    for s in ["10%\r", "20%\r", "\n", "x\r\n", "y"]:
+        output.write(s)
+    assert output.getvalue() == "20%\nx\ny"
+
+
+def test_long_line():
+    output = BoundedOutput(1, 1)
+    output.write("x" * (MAX_LINE_LENGTH + 5))
+    output.write("yyy\nz")
+    assert output.getvalue() == (
+        "x" * MAX_LINE_LENGTH + " ... 8 characters elided ...\nz")
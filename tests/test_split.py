@@ -0,0 +1,27 @@
+import pytest
+
+from sphinx_exhibit._implementation import split_text_and_code_blocks
+
+
+@pytest.mark.parametrize("src, expected", [
+    ("", [("code", "\n", 2)]),
+    ('"""\nTitle\n"""\n# comment\nx = 1\n\n\n',
+     [("text", "\nTitle\n", 1), ("code", "x = 1\n", 5)]),
+    # Comments trailing a compound statement belong to it.
+    ("for i in []:\n    pass\n# comment\n\n'text'\nif 0:\n    pass\n"
+     "else:\n    pass\n",
+     [("code", "for i in []:\n    pass\n# comment\n", 1),
+      ("text", "text", 5),
+      ("code", "if 0:\n    pass\nelse:\n    pass\n", 6)]),
+    ("@dec\n\ndef f(): pass\n'''a''' # comment\nr'b'\nb'c'\n",
+     [("code", "@dec\n\ndef f(): pass\n", 1),
+      ("text", "ab", 4),
+      ("code", "b'c'\n", 6)]),
+    # Keyword arguments to print() could not be parsed with lib2to3.
+    ("print(1, end='')\n'text'\n",
+     [("code", "print(1, end='')\n", 1),
+      ("text", "text", 2),
+      ("code", "\n", 4)]),
+])
+def test_split_text_and_code_blocks(src, expected):
+    assert [*split_text_and_code_blocks(src)] == expected
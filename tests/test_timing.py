@@ -0,0 +1,29 @@
+from sphinx_exhibit._timing import Timings, record_span
+
+
+class FakeApp:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, *args):
+        self.events.append((event, *args))
+
+
+def test_timings():
+    app = FakeApp()
+    timings = Timings(app)
+    with timings.span("foo", "doc"):
+        pass
+    worker_timings = {}
+    for _ in range(2):
+        with record_span(worker_timings, "bar"):
+            pass
+    timings.add_all(worker_timings, "other")
+    assert [(event, stage, docname)
+            for event, stage, _, docname in app.events] == [
+        ("exhibit-stage-timed", "foo", "doc"),
+        ("exhibit-stage-timed", "bar", "other")]
+    assert all(seconds >= 0 for _, _, seconds, _ in app.events)
+    summary = timings.format_summary()
+    assert [line.split()[0] for line in summary] == ["foo", "bar"]
+    assert summary[0].endswith("(1 span)")